@@ -1,18 +1,14 @@
-import asyncio
-import json
 import os
 import re
 import sys
-import time
+import threading
+from collections import deque
 from functools import partial
-from http.cookies import SimpleCookie
-from pathlib import Path
-from urllib.parse import quote
+from html import unescape
+from urllib.parse import quote, urlparse
 
-import requests
-from tqdm import tqdm
-
-from .utils import download_tesseract
+from .metrics import METRICS
+from .session import Session
 
 CATEGORY2CODE = {
     'movies': '48;17;44;45;47;50;51;52;42;46'.split(';'),
@@ -29,9 +25,8 @@ CATEGORY2CODE = {
 real_print = print
 pprint = print if sys.stdout.isatty() else partial(print, file=sys.stderr)
 
-HOME_DIRECTORY = os.environ.get('RARBGCLI_HOME', str(Path.home()))
-PROGRAM_HOME = os.path.join(HOME_DIRECTORY, '.rarbgcli')
-os.makedirs(PROGRAM_HOME, exist_ok=True)
+HOME_DIRECTORY = os.environ.get('RARBGCLI_HOME', os.path.expanduser('~'))
+PROGRAM_HOME = os.path.join(HOME_DIRECTORY, '.rarbgcli')  # created by whatever writes in it first
 COOKIES_PATH = os.path.join(PROGRAM_HOME, 'cookies.json')
 
 CODE2CATEGORY = {}
@@ -41,84 +36,21 @@ for category, codes in CATEGORY2CODE.items():
             CODE2CATEGORY[code] = category
 
 
-# Captcha solving taken from https://github.com/confident-hate/seedr-cli
 def solve_captcha(threat_defence_url):
-    from io import BytesIO
-
-    import pytesseract
-    from PIL import Image
-    from selenium import webdriver
-    from selenium.webdriver.chrome.options import Options
-    from selenium.webdriver.common.by import By
-    from selenium.webdriver.common.keys import Keys
-    from selenium.webdriver.support import expected_conditions as ec
-    from selenium.webdriver.support.ui import WebDriverWait
-    from webdriver_manager.chrome import ChromeDriverManager
-
-    def img2txt():
-        try:
-            clk_here_button = driver.find_element_by_link_text('Click here')
-            clk_here_button.click()
-            time.sleep(10)
-            WebDriverWait(driver, 10).until(ec.element_to_be_clickable((By.ID, 'solve_string')))
-        except Exception:
-            pass
-        finally:
-            element = driver.find_elements_by_css_selector('img')[1]
-            location = element.location
-            size = element.size
-            png = driver.get_screenshot_as_png()
-            x = location['x']
-            y = location['y']
-            width = location['x'] + size['width']
-            height = location['y'] + size['height']
-            im = Image.open(BytesIO(png))
-            im = im.crop((int(x), int(y), int(width), int(height)))
-            return pytesseract.image_to_string(im)
-
-    options = Options()
-    options.add_argument('--no-sandbox')
-    options.add_argument('--headless')
-    options.add_argument('--log-level=3')
-    options.add_argument('--disable-logging')
-    options.add_argument('--output=' + ('NUL' if sys.platform == 'win32' else '/dev/null'))
-
-    # import get_chrome_driver  # no longer needed since ChromeDriverManager exists
-    # chromedriver_path = get_chrome_driver.main(PROGRAM_HOME)
-    driver = webdriver.Chrome(
-        ChromeDriverManager(path=PROGRAM_HOME).install(),
-        chrome_options=options,
-        service_log_path=('NUL' if sys.platform == 'win32' else '/dev/null'),
-    )
-    pprint('successfully loaded chrome driver')
-
-    driver.implicitly_wait(10)
-    driver.get(threat_defence_url)
+    """solve the CAPTCHA with the `rarbg solver` daemon if it runs (its browser is already warm), otherwise with a browser started here"""
+    from rarbgcli.solver import CaptchaSolver, solve_remote
 
-    if sys.platform == 'win32':
-        pytesseract.pytesseract.tesseract_cmd = os.path.join(PROGRAM_HOME, 'Tesseract-OCR', 'tesseract')
-
-    try:
-        solution = img2txt()
-    except pytesseract.TesseractNotFoundError:
-        pprint('Tesseract not found. Downloading tesseract ...')
-        download_tesseract(PROGRAM_HOME)
-        solution = img2txt()
-
-    text_field = driver.find_element_by_id('solve_string')
-    text_field.send_keys(solution)
     try:
-        text_field.send_keys(Keys.RETURN)
-    except Exception as e:
-        pprint(e)
-
-    time.sleep(3)
-    cookies = {c['name']: c['value'] for c in (driver.get_cookies())}
-    driver.close()
-    return cookies
+        return solve_remote(threat_defence_url)
+    except (FileNotFoundError, ConnectionError):  # no daemon running (or it went away), a busy or failing one raises
+        pass
+    with CaptchaSolver() as solver:
+        return solver.solve(threat_defence_url)
 
 
 def cookies_txt_to_dict(cookies_txt: str) -> dict:
+    from http.cookies import SimpleCookie
+
     # SimpleCookie.load = lambda self, data: self.__init__(data.split(';'))
     cookie = SimpleCookie()
     cookie.load(cookies_txt)
@@ -166,68 +98,179 @@ def deal_with_threat_defence(threat_defence_url):
         return deal_with_threat_defence_manual(threat_defence_url)
 
 
-def get_page_html(target_url, cookies):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.122 Safari/537.36'}
+# only one thread at a time may solve the captcha, the others wait for its cookies
+_threat_defence_lock = threading.Lock()
+
+
+def get_page_html(target_url, cookies=None, session=None, cookie_manager=None, log=pprint):
+    """fetch target_url over `session` (a new one is made from `cookies` if not given), solving the threat defence captcha if needed.
+    The session cookies are updated in place, so pages fetched concurrently over the same session share a single captcha solve.
+    With a `cookie_manager` (rarbgcli.cookies.CookieManager) the outcome of each request is recorded and new cookies
+    are solved through it (saved, and shared with other processes), otherwise they're only kept in the session"""
+    if session is None:
+        session = Session(cookies)
+    cookies = session.cookies
     while True:
-        r = requests.get(target_url, headers=headers, cookies=cookies)
-        pprint('going to page', r.url, end=' ')
-        if 'threat_defence.php' not in r.url:
+        sent_cookies = dict(cookies)
+        with METRICS.stage('fetch'):
+            r = session.get(target_url, cookies=sent_cookies)
+        METRICS.count('pages_fetched')
+        log('going to page', r.url, end=' ')
+        defended = 'threat_defence.php' in r.url
+        if cookie_manager is not None:
+            cookie_manager.record(not defended)
+        if not defended:
             break
-        pprint('\ndefence detected')
-        cookies = deal_with_threat_defence(r.url)
-        # save cookies to json file
-        with open(COOKIES_PATH, 'w') as f:
-            json.dump(cookies, f)
+        log('\ndefence detected')
+        METRICS.count('captcha_redirects')
+        with _threat_defence_lock:
+            # if the cookies changed while waiting, another thread already solved it: just retry
+            if cookies == sent_cookies:
+                with METRICS.stage('captcha'):
+                    new_cookies = cookie_manager.solve(r.url, sent_cookies) if cookie_manager is not None else deal_with_threat_defence(r.url)
+                METRICS.count('captcha_solves')
+                cookies.clear()
+                cookies.update(new_cookies)
 
     data = r.text.encode('utf-8')
     return r, data, cookies
 
 
-def extract_torrent_file(anchor, domain='rarbgunblocked.org'):
+def fetch_pages(fetch_page, concurrency=4, start=1, last_page=None):
+    """speculatively call fetch_page(i) for pages start, start+1, ... in a thread pool and yield (i, result) in page order.
+    At most `concurrency` pages are in flight. The caller stops pagination (e.g. at the first empty page)
+    by breaking out of the loop, the pages still pending are then cancelled.
+    `last_page()` bounds the pages requested (None for no bound), it's asked again after each page is yielded."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    concurrency = max(1, int(concurrency))
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = deque()
+    next_page = start
+    try:
+        while True:
+            bound = last_page() if last_page is not None else None
+            while len(pending) < concurrency and (bound is None or next_page <= bound):
+                pending.append((next_page, executor.submit(fetch_page, next_page)))
+                next_page += 1
+            if not pending:
+                return
+            page, future = pending.popleft()
+            yield page, future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def torrent_file_url(href, name, domain='rarbgunblocked.org'):
+    """build the .torrent download url from a torrent page path ("/torrent/...") and the torrent name"""
     return (
             'https://'
             + domain
-            + anchor.get('href').replace('torrent/', 'download.php?id=')
+            + href.replace('torrent/', 'download.php?id=')
             + '&f='
-            + quote(anchor.contents[0] + '-[rarbg.to].torrent')
+            + quote(name + '-[rarbg.to].torrent')
             + '&tpageurl='
-            + quote(anchor.get('href').strip())
+            + quote(href.strip())
     )
 
 
+def extract_torrent_file(anchor, domain='rarbgunblocked.org'):
+    return torrent_file_url(anchor.get('href'), anchor.contents[0], domain)
+
+
 def open_url(url):
+    """open url with its default application, without waiting for it (and without a shell)"""
+    import subprocess
+
     if sys.platform == 'win32':
         os.startfile(url)
-    elif sys.platform in ['linux', 'linux2']:
-        os.system('xdg-open ' + url)
-    else:  # if mac os
-        os.system('open ' + url)
+    else:
+        opener = 'xdg-open' if sys.platform.startswith('linux') else 'open'  # else mac os
+        subprocess.Popen([opener, url], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
 
 async def open_torrentfiles(urls):
-    for url in tqdm(urls, 'downloading', total=len(urls)):
+    """open the urls in the browser, with a delay between each one beyond 5 urls so it isn't flooded"""
+    import asyncio
+
+    from tqdm import tqdm
+
+    for url in tqdm(urls, 'opening', total=len(urls)):
         open_url(url)
         if len(urls) > 5:
             await asyncio.sleep(0.5)
 
 
+# matches anything containing "over/*.jpg" *: anything
+THUMBNAIL_HASH_REGEX = re.compile(r'over\/(.*)\.jpg\\')
+TRACKERS = 'http%3A%2F%2Ftracker.trackerfix.com%3A80%2Fannounce&tr=udp%3A%2F%2F9.rarbg.me%3A2710&tr=udp%3A%2F%2F9.rarbg.to%3A2710'
+
+
+def magnet_url(hash_, title):
+    return f'magnet:?xt=urn:btih:{hash_}&dn={quote(title)}&tr={TRACKERS}'
+
+
+def hash_from_magnet(magnet):
+    match = re.search(r'btih:([0-9a-zA-Z]+)', magnet or '')
+    return match[1].lower() if match else ''
+
+
 def extract_magnet(anchor):
     # real:
     #     https://rarbgaccess.org/download.php?id=...&h=120&f=...-[rarbg.to].torrent
     #     https://rarbgaccess.org/download.php?id=...&      f=...-[rarbg.com].torrent
     # https://www.rarbgaccess.org/download.php?id=...&h=120&f=...-[rarbg.to].torrent
-    # matches anything containing "over/*.jpg" *: anything
-    regex = r'over\/(.*)\.jpg\\'
-    trackers = 'http%3A%2F%2Ftracker.trackerfix.com%3A80%2Fannounce&tr=udp%3A%2F%2F9.rarbg.me%3A2710&tr=udp%3A%2F%2F9.rarbg.to%3A2710'
     try:
-        hash_ = re.search(regex, str(anchor))[1]
-        title = quote(anchor.get('title'))
-        return f'magnet:?xt=urn:btih:{hash_}&dn={title}&tr={trackers}'
+        hash_ = THUMBNAIL_HASH_REGEX.search(str(anchor))[1]
+        return magnet_url(hash_, anchor.get('title'))
     except Exception:
         return ''
 
 
+# only the anchors we need from a torrent detail page, avoids building a whole parse tree
+_detail_links_regex = re.compile(r'''<a\s[^>]*?href=["']((?:magnet:|/download\.php)[^"']*)["']''', re.IGNORECASE)
+
+
+def extract_detail_links(html):
+    """returns (magnet, torrent_file) from a torrent detail page, either can be None if not found"""
+    magnet = torrent_file = None
+    for match in _detail_links_regex.finditer(html):
+        href = unescape(match[1])
+        if href.startswith('magnet:'):
+            magnet = magnet or href
+        else:
+            torrent_file = torrent_file or href
+        if magnet and torrent_file:
+            break
+    return magnet, torrent_file
+
+
+def fetch_detail_links(urls, session, max_per_host=4, log=pprint):
+    """fetch torrent detail pages concurrently over `session`, at most `max_per_host` requests per host.
+    returns {url: (magnet, torrent_file)}, pages that failed are left out"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    urls = list(urls)
+    if not urls:
+        return {}
+    host_limits = {urlparse(url).netloc: threading.BoundedSemaphore(max_per_host) for url in urls}
+    links = {}
+
+    def fetch(url):
+        with host_limits[urlparse(url).netloc]:
+            try:
+                links[url] = extract_detail_links(session.get(url).text)
+            except Exception as e:
+                log('Error:', e)
+
+    with METRICS.stage('detail_pages'), ThreadPoolExecutor(max_workers=min(len(urls), max_per_host * len(host_limits))) as executor:
+        list(executor.map(fetch, urls))
+    METRICS.count('detail_pages', len(urls))
+    return links
+
+
 size_units = {
     'B': 1,
     'KB': 10 ** 3,
@@ -256,34 +299,20 @@ def format_size(size: int, block_size=None):
         return f'{size / size_units[block_size]:.2f} {block_size}'
 
 
-def dict_to_fname(d):
-    # copy and sanitize
-    white_list = {'limit', 'category', 'order', 'search', 'descending'}
-    args_dict = {k: str(v).replace('"', '').replace(',', '') for k, v in sorted(vars(d).items()) if k in white_list}
-    filename = json.dumps(args_dict, indent=None, separators=(',', '='), ensure_ascii=False)[1:-1].replace('"', '')
-    return filename
-
-
 def unique(dicts):
-    seen = set()
-    deduped = []
+    """dedupe torrent dicts by info-hash (from the magnet link), falling back to the page url.
+    The first position is kept with the values of the last duplicate"""
+    deduped = {}
+    aliases = {}  # info-hash and path -> key
     for d in dicts:
-        t = tuple(d.items())
-        if t not in seen:
-            seen.add(t)
-            deduped.append(d)
-    return deduped
-
-
-def load_cookies(no_cookie):
-    # read cookies from json file
-    cookies = {}
-    # make empty cookie if cookie doesn't already exist
-    if not os.path.exists(COOKIES_PATH):
-        with open(COOKIES_PATH, 'w') as f:
-            json.dump({}, f)
-
-    if not no_cookie:
-        with open(COOKIES_PATH, 'r') as f:
-            cookies = json.load(f)
-    return cookies
+        hash_, path = hash_from_magnet(d.get('magnet')), urlparse(d.get('href') or '').path
+        key = aliases.get(hash_) or aliases.get(path) or hash_ or path or tuple(d.items())
+        deduped[key] = d
+        for alias in (hash_, path):
+            if alias:
+                aliases[alias] = key
+    return list(deduped.values())
+
+
+# the library API, imported last since it is built on everything above
+from rarbgcli.api import aiter_torrents, iter_batch, iter_torrents  # noqa: E402,F401
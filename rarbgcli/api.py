@@ -0,0 +1,460 @@
+"""
+library API over the scraping pipeline: nothing is printed and no files are written (unless a store is given).
+
+    import rarbgcli
+
+    for torrent in rarbgcli.iter_torrents('the stranger things 3', category='tvshows', limit=10):
+        print(torrent.title, torrent.magnet, torrent.size)
+
+    async for torrent in rarbgcli.aiter_torrents('the stranger things 3', limit=10):
+        ...
+
+    for result in rarbgcli.iter_batch(['the stranger things 3', 'dark'], limit=10):
+        print(result.search, len(result.records))
+
+The session (cookies, connection pool), the cookie manager and the torrent store are all injectable.
+"""
+
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import quote
+
+from rarbgcli import CATEGORY2CODE, fetch_detail_links, fetch_pages, get_page_html, hash_from_magnet
+from rarbgcli.cache import PAGE_CACHE
+from rarbgcli.filters import rank
+from rarbgcli.metrics import METRICS
+from rarbgcli.parser import DEFAULT_BACKEND, parse_listing
+from rarbgcli.planner import PagePlanner
+from rarbgcli.record import TorrentIndex, TorrentKeys, hash_to_bytes
+from rarbgcli.session import Session
+from rarbgcli.store import query_key, rows_hash
+
+# status is one of:
+#   'fetched'      downloaded and parsed
+#   'unchanged'    downloaded, but the rows are the same as the last time
+#   'known_fresh'  downloaded, every row was already stored and fresh: iteration stops after this page
+#   'cached'       still fresh in the store or the in-memory page cache, not downloaded (response is None)
+#   'error'        the server answered with an error status: iteration stops
+Page = namedtuple('Page', ['number', 'rows', 'response', 'status'])
+
+
+def _quiet(*args, **kwargs):
+    pass
+
+
+def listing_url(search, page, domain='rarbgunblocked.org', category='', order='', sort_order=None):
+    url = f'https://{domain.strip()}/torrents.php?search={quote(search)}&page={page}'
+    if sort_order:
+        url += '&by=' + sort_order.upper().strip()
+    if order:
+        url += '&order=' + order.strip()
+    if category:
+        url += '&category=' + ';'.join(CATEGORY2CODE[category])
+    return url
+
+
+def iter_pages(
+    search,
+    category='',
+    order='',
+    sort_order=None,
+    domain='rarbgunblocked.org',
+    session=None,
+    store=None,
+    cache_ttl=3600,
+    concurrency=4,
+    parser=DEFAULT_BACKEND,
+    cookie_manager=None,
+    log=_quiet,
+    page_cache=PAGE_CACHE,
+    planner=None,
+):
+    """yields a Page for every result page, in order, until the first empty page.
+    With a `store`, every fetched page is upserted in it and pages fetched less than `cache_ttl` seconds ago are taken from it.
+    `cookie_manager` (a rarbgcli.cookies.CookieManager) tracks the cookies and solves the captcha, new cookies aren't saved if None.
+    `page_cache` (a rarbgcli.cache.PageCache, the process wide one by default) keeps the parsed pages in memory, None disables it.
+    `planner` (a rarbgcli.planner.PagePlanner the caller feeds the pages) bounds the pages prefetched, and ends the iteration when done"""
+    session = session if session is not None else Session()
+    query = query_key(search, category, order, sort_order)
+
+    fresh_since = time.time() - cache_ttl
+    with METRICS.stage('store'):
+        page_meta = store.page_meta(query) if store is not None and cache_ttl > 0 else {}
+        stored_pages = store.page_rows(query) if page_meta else {}
+    # a fresh empty page is the known end of the results, nothing after it is fetched
+    last_page = min((p for p, meta in page_meta.items() if meta['row_count'] == 0 and meta['fetched'] >= fresh_since), default=None)
+
+    validated = []  # the cookies are checked once, before the first page that's actually downloaded
+    validate_lock = threading.Lock()
+
+    def fetch_page(i):
+        if i in page_meta and page_meta[i]['fetched'] >= fresh_since:
+            METRICS.count('pages_from_store')
+            return None, stored_pages.get(i, [])
+        if last_page is not None and i > last_page:
+            return None, []
+        url = listing_url(search, i, domain, category, order, sort_order)
+        if page_cache is not None and cache_ttl > 0:
+            rows = page_cache.get(url, max_age=cache_ttl)
+            if rows is not None:
+                METRICS.count('pages_from_memory')
+                return None, rows
+        if cookie_manager is not None:
+            with validate_lock:  # the other page threads wait here, rather than all running into the captcha
+                if not validated:
+                    cookie_manager.ensure_valid(session, domain)
+                    validated.append(True)
+        r, html, _ = get_page_html(url, session=session, cookie_manager=cookie_manager, log=log)
+        rows = parse_listing(html, backend=parser)
+        if page_cache is not None and r.status_code == 200:
+            page_cache.put(url, rows)
+        return r, rows
+
+    for i, (r, rows) in fetch_pages(fetch_page, concurrency=concurrency, last_page=planner.last_page if planner is not None else None):
+        if r is None:
+            yield Page(i, rows, None, 'cached')
+        elif r.status_code != 200:
+            yield Page(i, [], r, 'error')
+            return
+        elif store is None:
+            yield Page(i, rows, r, 'fetched')
+        else:
+            with METRICS.stage('store'):
+                rows = store.fill_known_hashes(rows)
+                content_hash = rows_hash(rows)
+                if i in page_meta and page_meta[i]['content_hash'] == content_hash:
+                    status = 'unchanged'
+                else:
+                    status = 'known_fresh' if rows and cache_ttl > 0 and store.count_fresh(rows, fresh_since, query) == len(rows) else 'fetched'
+                    store.upsert(rows, query=query, page=i)
+                store.set_page_meta(query, i, r.url, content_hash, len(rows))
+            yield Page(i, rows, r, status)
+            if status == 'known_fresh':
+                return
+
+        if not rows:
+            return
+
+
+def resolve_hashes(records, session, domain='rarbgunblocked.org', max_per_host=4, log=_quiet):
+    """records without an info-hash get it from their detail page, returns the records in the same order.
+    The detail pages that fail are reported to `log` and their records are left without a hash"""
+    urls = {record.url(domain): record for record in records if not record.info_hash}
+    links = fetch_detail_links(urls, session, max_per_host, log=log)
+    hashes = {url: hash_to_bytes(hash_from_magnet(magnet)) for url, (magnet, _) in links.items() if magnet}
+    return [record._replace(info_hash=hashes.get(record.url(domain), b'')) if not record.info_hash else record for record in records]
+
+
+def resolve_torrents(records, session, domain='rarbgunblocked.org', concurrency=4, store=None, log=_quiet):
+    """resolve_hashes, recording the new hashes in the store"""
+    resolved = resolve_hashes(records, session, domain, max_per_host=concurrency, log=log)
+    if store is not None:
+        for before, after in zip(records, resolved):
+            if after.info_hash and not before.info_hash:
+                store.set_hash(after.path, after.hash)
+    return resolved
+
+
+def iter_torrents(
+    search,
+    category='',
+    order='',
+    sort_order=None,
+    limit=float('inf'),
+    domain='rarbgunblocked.org',
+    session=None,
+    cookies=None,
+    cookie_manager=None,
+    store=None,
+    cache_ttl=3600,
+    concurrency=4,
+    parser=DEFAULT_BACKEND,
+    resolve=False,
+    page_cache=PAGE_CACHE,
+    torrent_filter=None,
+    sort=(),
+    on_page=None,
+    log=_quiet,
+):
+    """lazily fetch and parse the result pages of a search and yield the torrents one by one
+    as rarbgcli.record.TorrentRecord (`.to_dict(domain)` gives the dict `main` outputs).
+    Pages are only fetched as the iteration goes on, a torrent listed again on a later page is yielded once.
+
+    session:         a rarbgcli.session.Session to reuse, otherwise one is made from `cookies`
+    cookie_manager:  a rarbgcli.cookies.CookieManager to save newly solved captcha cookies with (and reuse other processes' ones)
+    store:           a rarbgcli.store.TorrentStore used as cache, nothing is cached if None
+    resolve:         fetch the detail page of torrents without an info-hash to get it
+    page_cache:      a rarbgcli.cache.PageCache of the parsed pages (the process wide one by default), None disables it
+    torrent_filter:  a rarbgcli.filters.TorrentFilter, only the torrents it keeps are yielded (and count in the limit)
+    sort:            the keys the torrents are ranked by afterwards (see collect_torrents): the limit then only
+                     stops the pages once they can't change the top `limit`, every torrent of those pages is yielded
+    on_page:         called with each rarbgcli.api.Page as it comes, before its torrents are yielded
+    log:             print-like function for the progress messages and the detail pages that failed, silent by default
+    """
+    pages = iter_torrent_pages(
+        search,
+        category,
+        order,
+        sort_order,
+        limit,
+        domain,
+        session=session,
+        cookies=cookies,
+        cookie_manager=cookie_manager,
+        store=store,
+        cache_ttl=cache_ttl,
+        concurrency=concurrency,
+        parser=parser,
+        resolve=resolve,
+        page_cache=page_cache,
+        torrent_filter=torrent_filter,
+        sort=sort,
+        on_page=on_page,
+        log=log,
+    )
+    for _, records in pages:
+        yield from records
+
+
+def iter_torrent_pages(
+    search,
+    category='',
+    order='',
+    sort_order=None,
+    limit=float('inf'),
+    domain='rarbgunblocked.org',
+    session=None,
+    cookies=None,
+    cookie_manager=None,
+    store=None,
+    cache_ttl=3600,
+    concurrency=4,
+    parser=DEFAULT_BACKEND,
+    resolve=False,
+    page_cache=PAGE_CACHE,
+    torrent_filter=None,
+    sort=(),
+    on_page=None,
+    log=_quiet,
+):
+    """iter_torrents (same arguments), yielding (page, torrents) for each result page: the new torrents it brought"""
+    own_session = session is None
+    if own_session:
+        session = Session(cookies, pool_maxsize=concurrency)
+
+    count = 0
+    seen = TorrentKeys()  # only the keys, the records are handed out page by page
+    # stops the pagination once the limit is met, a sort the site's order doesn't match needs every page
+    planner = PagePlanner(limit, sort=sort, order=order, sort_order=sort_order)
+    try:
+        pages = iter_pages(
+            search,
+            category,
+            order,
+            sort_order,
+            domain,
+            session,
+            store,
+            cache_ttl,
+            concurrency,
+            parser,
+            cookie_manager,
+            log=log,
+            page_cache=page_cache,
+            planner=planner,
+        )
+        for page in pages:
+            if on_page is not None:
+                on_page(page)
+            records = [row for row in page.rows if row not in seen]
+            seen.add(page.rows)
+            records = torrent_filter.apply(records) if torrent_filter else records
+            planner.add(records, len(page.rows))
+            if limit < float('inf') and not sort:
+                records = records[: int(limit) - count]
+            if resolve:
+                records = resolve_torrents(records, session, domain, concurrency, store, log=log)
+            yield page, records
+            count += len(records)
+            if planner.done():
+                log(f'reached limit {limit} after {planner.pages} pages, stopping')
+                return
+    finally:
+        if own_session:
+            session.close()
+
+
+class LockedStore:
+    """a TorrentStore shared by several threads, its methods are called one at a time"""
+
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._store, name)
+        if not callable(attr):
+            return attr
+
+        def locked(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+
+        return locked
+
+
+def collect_torrents(
+    search,
+    category='',
+    order='',
+    sort_order=None,
+    limit=float('inf'),
+    domain='rarbgunblocked.org',
+    session=None,
+    cookies=None,
+    cookie_manager=None,
+    store=None,
+    cache_ttl=3600,
+    concurrency=4,
+    parser=DEFAULT_BACKEND,
+    resolve=False,
+    torrent_filter=None,
+    sort=(),
+    on_page=None,
+    log=_quiet,
+):
+    """all the torrents of a search as a list (iter_torrents takes the same arguments), deduplicated and,
+    with a store, completed with the ones the search returned on previous runs.
+    `sort` ranks them (see rarbgcli.filters.rank) before the limit, which needs all the pages unless the site's `order` already
+    lists them that way, and only the torrents that make the cut are resolved.
+    This is the pipeline of `rarbg`, `rarbg --batch` and `rarbg serve`"""
+    own_session = session is None  # kept open for the resolution after the ranking
+    if own_session:
+        session = Session(cookies, pool_maxsize=concurrency)
+    try:
+        index = TorrentIndex(
+            iter_torrents(
+                search,
+                category,
+                order,
+                sort_order,
+                limit,
+                domain,
+                session=session,
+                cookie_manager=cookie_manager,
+                store=store,
+                cache_ttl=cache_ttl,
+                concurrency=concurrency,
+                parser=parser,
+                resolve=resolve and not sort,
+                torrent_filter=torrent_filter,
+                sort=sort,
+                on_page=on_page,
+                log=log,
+            )
+        )
+        index.add(stored_torrents(store, search, category, order, sort_order, cache_ttl, torrent_filter), overwrite=False)
+        records = rank(index, sort) if sort else list(index)
+        records = records[: int(limit)] if limit < float('inf') else records
+        if resolve and sort:
+            records = resolve_torrents(records, session, domain, concurrency, store, log=log)
+        return records
+    finally:
+        if own_session:
+            session.close()
+
+
+def stored_torrents(store, search, category='', order='', sort_order=None, cache_ttl=3600, torrent_filter=None):
+    """the torrents the search returned on previous runs (none without a store or with caching disabled), filtered"""
+    if store is None or cache_ttl <= 0:
+        return []
+    records = store.query_rows(query_key(search, category, order, sort_order))
+    return torrent_filter.apply(records) if torrent_filter else records
+
+
+BatchResult = namedtuple('BatchResult', ['search', 'records', 'error'])
+
+
+def iter_batch(
+    searches,
+    category='',
+    order='',
+    sort_order=None,
+    limit=float('inf'),
+    domain='rarbgunblocked.org',
+    session=None,
+    cookies=None,
+    cookie_manager=None,
+    store=None,
+    cache_ttl=3600,
+    concurrency=4,
+    parser=DEFAULT_BACKEND,
+    resolve=False,
+    torrent_filter=None,
+    sort=(),
+):
+    """run many searches over one session and yield a BatchResult for each, in the order they finish.
+    At most `concurrency` pages are fetched at a time over all the searches (the pages of one search are fetched in order),
+    a rate limit can be set on the session. Each search's records are the ones collect_torrents returns.
+    A failed search yields its exception as `error`"""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    own_session = session is None
+    if own_session:
+        session = Session(cookies, pool_maxsize=concurrency)
+    shared_store = LockedStore(store) if store is not None else None
+
+    def run(search):
+        return collect_torrents(
+            search,
+            category,
+            order,
+            sort_order,
+            limit,
+            domain,
+            session=session,
+            cookie_manager=cookie_manager,
+            store=shared_store,
+            cache_ttl=cache_ttl,
+            concurrency=1,
+            parser=parser,
+            resolve=resolve,
+            torrent_filter=torrent_filter,
+            sort=sort,
+        )
+
+    executor = ThreadPoolExecutor(max_workers=max(1, int(concurrency)))
+    futures = {}
+    try:
+        futures = {executor.submit(run, search): search for search in searches}
+        for future in as_completed(futures):
+            error = future.exception()
+            yield BatchResult(futures[future], [] if error else future.result(), error)
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        if own_session:
+            session.close()
+
+
+async def aiter_torrents(*args, **kwargs):
+    """async counterpart of iter_torrents (same arguments), the blocking fetches run in a worker thread"""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    loop = asyncio.get_event_loop()
+    # a single thread, so the store (if any) is always used from the same thread
+    executor = ThreadPoolExecutor(max_workers=1)
+    iterator = iter_torrents(*args, **kwargs)
+    done = object()
+    try:
+        while True:
+            torrent = await loop.run_in_executor(executor, next, iterator, done)
+            if torrent is done:
+                break
+            yield torrent
+    finally:
+        await loop.run_in_executor(executor, iterator.close)
+        executor.shutdown(wait=False)
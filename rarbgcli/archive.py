@@ -0,0 +1,149 @@
+"""
+archive of the raw listing pages, replacing the plain history/<session>_torrents_<i>.html dumps.
+
+Pages are stored gzip compressed and content addressed (objects/<sha1[:2]>/<sha1>.html.gz), so a page fetched again
+with the same content takes no space. manifest.ndjson has one line per fetch: url, fetch time, content hash and sizes.
+Writes happen on a background thread, the pagination never waits on the disk.
+Entries older than `max_age_days` (and the oldest ones beyond `max_bytes`) are pruned when the archive is closed.
+Several runs can share the archive: writes and pruning hold a lock on archive.lock, so a run never prunes an object
+another one is about to reference, nor rewrites the manifest under its appends.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+
+from rarbgcli import PROGRAM_HOME
+from rarbgcli.cookies import file_lock
+
+ARCHIVE_DIR = os.path.join(PROGRAM_HOME, 'archive')
+MANIFEST_NAME = 'manifest.ndjson'
+LOCK_NAME = 'archive.lock'
+
+
+class PageArchive:
+    def __init__(self, path=ARCHIVE_DIR, max_age_days=30, max_bytes=None, compresslevel=6):
+        self.path = path
+        self.manifest_path = os.path.join(path, MANIFEST_NAME)
+        self.lock_path = os.path.join(path, LOCK_NAME)
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.compresslevel = compresslevel
+        self._queue = queue.Queue()
+        self._writer = None
+
+    def object_path(self, sha1):
+        return os.path.join(self.path, 'objects', sha1[:2], sha1 + '.html.gz')
+
+    def add(self, url, html, fetched=None):
+        """queue a page to be archived, returns immediately"""
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name='page-archive', daemon=True)
+            self._writer.start()
+        self._queue.put((url, html, time.time() if fetched is None else fetched))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except OSError as e:  # a page that can't be archived isn't worth failing the run
+                print('could not archive page:', e, file=sys.stderr)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, url, html, fetched):
+        data = html.encode('utf8') if isinstance(html, str) else html
+        sha1 = hashlib.sha1(data).hexdigest()
+        path = self.object_path(sha1)
+        # the object and its manifest entry appear together, a prune in another process sees both or neither
+        with file_lock(self.lock_path):
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(gzip.compress(data, self.compresslevel))
+                os.replace(tmp_path, path)  # readers never see a partial object
+            entry = {'url': url, 'fetched': fetched, 'sha1': sha1, 'bytes': len(data), 'compressed': os.path.getsize(path)}
+            with open(self.manifest_path, 'a', encoding='utf8') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def entries(self):
+        """the manifest entries, oldest first"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf8') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def read(self, sha1):
+        with gzip.open(self.object_path(sha1), 'rb') as f:
+            return f.read().decode('utf8', errors='replace')
+
+    def iter_pages(self):
+        """(entry, html) of every distinct archived page, latest fetch of each"""
+        latest = {entry['sha1']: entry for entry in self.entries()}
+        for sha1, entry in latest.items():
+            try:
+                yield entry, self.read(sha1)
+            except FileNotFoundError:
+                continue
+
+    def prune(self):
+        """apply the retention policy, returns the number of objects deleted"""
+        if not os.path.isdir(self.path):
+            return 0
+        with file_lock(self.lock_path):
+            return self._prune()
+
+    def _prune(self):
+        all_entries = entries = self.entries()
+        if self.max_age_days is not None:
+            oldest = time.time() - self.max_age_days * 24 * 3600
+            entries = [entry for entry in entries if entry['fetched'] >= oldest]
+        if self.max_bytes is not None:
+            sizes = {entry['sha1']: entry['compressed'] for entry in entries}
+            references = Counter(entry['sha1'] for entry in entries)
+            total = sum(sizes.values())
+            while entries and total > self.max_bytes:  # drop the oldest pages first
+                dropped = entries.pop(0)['sha1']
+                references[dropped] -= 1
+                if not references[dropped]:
+                    total -= sizes[dropped]
+        if len(entries) == len(all_entries):
+            return 0
+
+        tmp_path = f'{self.manifest_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        os.replace(tmp_path, self.manifest_path)
+
+        unreferenced = {entry['sha1'] for entry in all_entries} - {entry['sha1'] for entry in entries}
+        for sha1 in unreferenced:
+            try:
+                os.remove(self.object_path(sha1))
+            except FileNotFoundError:
+                pass
+        return len(unreferenced)
+
+    def close(self):
+        """wait for the queued pages to be written, then prune"""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        self.prune()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,194 @@
+"""
+rarbg bench - micro-benchmarks of the parsing hot paths over saved listing pages (no network needed).
+
+Runs over the pages of the archive `main` keeps in ~/.rarbgcli/archive (and the `*_torrents_*.html` pages
+older versions saved in ~/.rarbgcli/history) by default:
+
+    $ rarbg bench
+    $ rarbg bench path/to/pages --backends stream lxml --repeat 5 --json
+
+--startup measures the startup of the CLI instead (import time, time to first output of `rarbg --help`),
+and fails if importing it loads one of the heavy dependencies that are meant to be imported lazily:
+
+    $ rarbg bench --startup
+
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from rarbgcli import PROGRAM_HOME, extract_magnet, extract_torrent_file, format_size, parse_size, unique
+from rarbgcli.archive import ARCHIVE_DIR, MANIFEST_NAME, PageArchive
+from rarbgcli.parser import BACKENDS, parse_listing
+
+
+def load_corpus(paths, max_pages=None):
+    pages = []
+    files = []
+    for path in paths:
+        if os.path.exists(os.path.join(path, MANIFEST_NAME)):
+            pages += [html for _, html in PageArchive(path).iter_pages()]
+        elif os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '*_torrents_*.html')))
+        elif os.path.exists(path):
+            files.append(path)
+    for fname in files:
+        with open(fname, 'r', encoding='utf8') as f:
+            pages.append(f.read())
+    return pages[:max_pages]
+
+
+def measure(name, func, repeat=3):
+    """run func() `repeat` times and keep the best time, func returns the number of items it processed.
+    Peak memory is measured on an extra (traced) run, so tracing doesn't skew the timings"""
+    best = float('inf')
+    items = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'name': name,
+        'items': items,
+        'seconds': best,
+        'items_per_sec': items / best if best else float('inf'),
+        'peak_kib': peak / 1024,
+    }
+
+
+def run_benchmarks(pages, backends=BACKENDS, repeat=3):
+    results = []
+
+    available = []
+    for backend in backends:
+        try:
+            parse_listing('', backend)
+            available.append(backend)
+        except (ImportError, ValueError) as e:  # bs4.FeatureNotFound is a ValueError
+            print(f'skipping backend {backend}: {e}', file=sys.stderr)
+
+    for backend in available:
+        results.append(measure(f'parse_listing[{backend}]', lambda: sum(len(parse_listing(page, backend)) for page in pages), repeat))
+
+    rows = [row for page in pages for row in parse_listing(page, available[0] if available else 'stream')]
+    results.append(measure('TorrentRecord.to_dict', lambda: len([row.to_dict() for row in rows]), repeat))
+
+    try:
+        from bs4 import BeautifulSoup
+
+        anchors = [a for page in pages for a in BeautifulSoup(page, 'html.parser').select('tr.lista2 a[href^="/torrent/"][title]')]
+        results.append(measure('extract_magnet', lambda: len(list(map(extract_magnet, anchors))), repeat))
+        results.append(measure('extract_torrent_file', lambda: len(list(map(extract_torrent_file, anchors))), repeat))
+    except ImportError as e:
+        print(f'skipping anchor benchmarks: {e}', file=sys.stderr)
+
+    sizes = [format_size(row.size) for row in rows]
+    results.append(measure('parse_size', lambda: len(list(map(parse_size, sizes))), repeat))
+    raw_sizes = [row.size for row in rows]
+    results.append(measure('format_size', lambda: len(list(map(format_size, raw_sizes))), repeat))
+
+    dicts = [row.to_dict() for row in rows]
+    results.append(measure('unique', lambda: len(unique(dicts + dicts)), repeat))
+    return results
+
+
+# only imported on the code paths that need them, never when importing rarbgcli
+LAZY_MODULES = ['requests', 'urllib3', 'tqdm', 'yaml', 'bs4', 'lxml', 'asyncio', 'wget', 'selenium', 'PIL', 'pytesseract', 'numpy']
+
+
+def _python_env():
+    """environment for child interpreters that import this rarbgcli, even when it isn't installed"""
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_parent, os.environ.get('PYTHONPATH')])))
+
+
+def _run_python(args, repeat):
+    """best time to the first byte of output (or the exit) of a fresh interpreter running `args`"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, *args], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=_python_env())
+        proc.stdout.read(1)
+        best = min(best, time.perf_counter() - start)
+        proc.communicate()
+    return best
+
+
+def run_startup_benchmarks(repeat=5):
+    seconds = {
+        'python -c pass': _run_python(['-c', 'pass'], repeat),  # interpreter startup alone, as a baseline
+        'import rarbgcli.rarbgcli': _run_python(['-c', 'import rarbgcli.rarbgcli'], repeat),
+        'rarbg --help': _run_python(['-m', 'rarbgcli', '--help'], repeat),
+    }
+    loaded = subprocess.run(
+        [sys.executable, '-c', f'import sys, rarbgcli.rarbgcli; print(*[m for m in {LAZY_MODULES!r} if m in sys.modules])'],
+        stdout=subprocess.PIPE,
+        env=_python_env(),
+        universal_newlines=True,
+    ).stdout.split()
+    return {'seconds': seconds, 'lazy_modules_loaded': loaded}
+
+
+def format_table(results):
+    lines = [f"{'benchmark':32} {'items':>8} {'seconds':>10} {'items/sec':>12} {'peak KiB':>10}"]
+    for r in results:
+        lines.append(f"{r['name']:32} {r['items']:>8} {r['seconds']:>10.4f} {r['items_per_sec']:>12.0f} {r['peak_kib']:>10.1f}")
+    return '\n'.join(lines)
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser('rarbg bench', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'corpus',
+        nargs='*',
+        default=[ARCHIVE_DIR, os.path.join(PROGRAM_HOME, 'history')],
+        help='Saved listing pages, page archives, or directories containing *_torrents_*.html pages',
+    )
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=BACKENDS, help='Parser backends to compare')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs per benchmark, the best one is kept')
+    parser.add_argument('--max_pages', type=int, default=None, help='Only use the first N pages of the corpus')
+    parser.add_argument('--json', action='store_true', help='Output results as JSON')
+    parser.add_argument('--startup', action='store_true', help='Benchmark the CLI startup instead, fails if a lazy dependency is imported eagerly')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = get_args(argv)
+    if args.startup:
+        results = run_startup_benchmarks(args.repeat)
+        if args.json:
+            print(json.dumps(results, indent=4))
+        else:
+            print('\n'.join(f'{name:32} {seconds:>10.4f}' for name, seconds in results['seconds'].items()))
+        if results['lazy_modules_loaded']:
+            print('imported eagerly:', *results['lazy_modules_loaded'], file=sys.stderr)
+            return 1
+        return 0
+
+    pages = load_corpus(args.corpus, args.max_pages)
+    if not pages:
+        print('no saved listing pages found in', args.corpus, file=sys.stderr)
+        return 1
+    print(f'{len(pages)} pages', file=sys.stderr)
+
+    results = run_benchmarks(pages, args.backends, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print(format_table(results))
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,65 @@
+"""
+in-memory cache of parsed listing pages, keyed by the listing url, so a page seen earlier in the process
+(interactive paging, repeated library calls, the server) isn't fetched and parsed again.
+Holds the parsed rows, not the html. Bounded by entry count and by total number of rows, least recently used first out.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class PageCache:
+    def __init__(self, max_entries=512, max_rows=25 * 512, ttl=600):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self._entries = OrderedDict()  # url -> (stored at, rows)
+        self._rows = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, url, max_age=None):
+        """the rows cached for url if they're younger than the ttl (and max_age), else None"""
+        max_age = self.ttl if max_age is None else min(max_age, self.ttl)
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None or time.monotonic() - entry[0] > max_age:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, url, rows):
+        rows = list(rows)
+        with self._lock:
+            self._remove(url)
+            self._entries[url] = (time.monotonic(), rows)
+            self._rows += len(rows)
+            while len(self._entries) > self.max_entries or (self._rows > self.max_rows and len(self._entries) > 1):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, url):
+        entry = self._entries.pop(url, None)
+        if entry is not None:
+            self._rows -= len(entry[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'rows': self._rows, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+# shared by everything in the process that doesn't pass its own
+PAGE_CACHE = PageCache()
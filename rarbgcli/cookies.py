@@ -0,0 +1,170 @@
+"""
+lifecycle of the captcha cookies (cookies.json).
+
+Next to the cookies, cookies_meta.json records when they were solved, when they last worked
+and how many requests went through or hit the captcha with them.
+Solving happens under an exclusive file lock: when several rarbgcli processes on the same host hit the captcha
+at once, only the first one solves it and the others pick up its cookies.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urljoin
+
+from rarbgcli import COOKIES_PATH, deal_with_threat_defence, pprint
+
+
+@contextmanager
+def file_lock(path):
+    """exclusive lock between processes, held as long as the context"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a+') as f:
+        if sys.platform == 'win32':
+            import msvcrt
+
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after 10 seconds, keep waiting
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class CookieManager:
+    # cookies that worked less than this many seconds ago aren't checked again before a batch
+    TRUST_SECONDS = 300
+
+    def __init__(self, path=COOKIES_PATH, log=pprint):
+        self.path = path
+        self.meta_path = os.path.splitext(path)[0] + '_meta.json'
+        self.lock_path = path + '.lock'
+        self.log = log
+        self._lock = threading.Lock()
+        self._successes = 0
+        self._failures = 0
+        self._last_success = None  # not flushed yet
+        self._validate_lock = threading.Lock()
+        self._known = None  # the saved cookies this process already knows of, the ones another process solves differ
+        self._no_cookie = False
+
+    def _read_json(self, path, default):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    def _write_json(self, path, data):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)  # atomic, readers never see a half written file
+
+    def load(self, no_cookie=False):
+        if not os.path.exists(self.path):
+            self._write_json(self.path, {})
+        self._known = self._read_json(self.path, {})
+        self._no_cookie = no_cookie
+        return {} if no_cookie else self._known
+
+    @property
+    def meta(self):
+        return self._read_json(self.meta_path, {})
+
+    @property
+    def age(self):
+        """seconds since the cookies were solved, None if unknown"""
+        solved = self.meta.get('solved')
+        return None if solved is None else time.time() - solved
+
+    @property
+    def success_rate(self):
+        meta = self.meta
+        total = meta.get('successes', 0) + meta.get('failures', 0)
+        return None if total == 0 else meta.get('successes', 0) / total
+
+    def record(self, success):
+        """count a request that went through (True) or got the captcha (False), persisted by flush()"""
+        with self._lock:
+            if success:
+                self._successes += 1
+                self._last_success = time.time()
+            else:
+                self._failures += 1
+
+    def flush(self):
+        with self._lock:
+            successes, failures, last_success = self._successes, self._failures, self._last_success
+            self._successes = self._failures = 0
+        if not successes and not failures:
+            return
+        with file_lock(self.lock_path):
+            meta = self.meta
+            meta['successes'] = meta.get('successes', 0) + successes
+            meta['failures'] = meta.get('failures', 0) + failures
+            if last_success is not None:
+                meta['last_success'] = max(meta.get('last_success', 0), last_success)
+            self._write_json(self.meta_path, meta)
+
+    def solve(self, threat_defence_url, sent_cookies):
+        """new cookies for the captcha at threat_defence_url.
+        If another process saved new cookies since this one loaded them, and they aren't the ones that just failed (sent_cookies),
+        those are used instead"""
+        with file_lock(self.lock_path):
+            saved = self._read_json(self.path, {})
+            if saved and saved != sent_cookies and saved != self._known:
+                self.log('using the cookies solved by another process')
+                self._known = saved
+                return saved
+
+            cookies = deal_with_threat_defence(threat_defence_url)
+            self._write_json(self.path, cookies)
+            self._known = cookies
+            meta = self.meta
+            meta.update({'solved': time.time(), 'successes': 0, 'failures': 0})
+            self._write_json(self.meta_path, meta)
+            return cookies
+
+    def ensure_valid(self, session, domain):
+        """check the session cookies with one cheap request before starting a batch, and solve the captcha right away if needed,
+        so the batch's concurrent requests don't all run into it. Returns True if the cookies had to be replaced"""
+        with self._validate_lock:  # concurrent batches wait for the first check instead of all making one
+            return self._ensure_valid(session, domain)
+
+    def _ensure_valid(self, session, domain):
+        # with --no_cookie the saved cookies' successes say nothing about the session's
+        last_success = max(filter(None, [None if self._no_cookie else self.meta.get('last_success'), self._last_success]), default=None)
+        if last_success is not None and time.time() - last_success < self.TRUST_SECONDS:
+            return False
+
+        r = session.head(f'https://{domain.strip()}/torrents.php', allow_redirects=False)
+        location = r.headers.get('Location', '')
+        if 'threat_defence.php' not in location:
+            self.record(True)
+            return False
+
+        self.record(False)
+        self.log('cookies expired, solving the captcha before starting')
+        new_cookies = self.solve(urljoin(r.url, location), dict(session.cookies))
+        session.cookies.clear()
+        session.cookies.update(new_cookies)
+        return True
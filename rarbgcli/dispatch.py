@@ -0,0 +1,132 @@
+"""
+hands the selected torrents over for downloading, without a shell (or a browser tab) per link:
+
+- .torrent files are downloaded straight into a directory, concurrently over the run's session (its cookies, pool and rate limit)
+- magnet links are passed to a torrent client command all at once: `qbittorrent <magnet> <magnet> ...`
+- or written as .magnet files into a client's watch folder
+
+Without any of these, the .torrent urls are opened in the browser like before.
+"""
+
+import os
+import re
+import shlex
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from rarbgcli import COOKIES_PATH, hash_from_magnet, open_torrentfiles
+from rarbgcli.cookies import CookieManager
+from rarbgcli.session import Session
+
+# stay well below the command line length limits (32k characters on windows)
+MAX_COMMAND_CHARS = 30000
+
+
+def torrent_filename(url):
+    """the file name a .torrent url downloads as"""
+    name = parse_qs(urlsplit(url).query).get('f', [''])[0] or os.path.basename(urlsplit(url).path)
+    name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', '_', name).strip(' .') or 'download'
+    return name if name.endswith('.torrent') else name + '.torrent'
+
+
+def download_torrent(url, directory, session):
+    """download one .torrent file into directory, returns its path. Raises ValueError if the server didn't answer with a torrent"""
+    r = session.get(url)
+    # a torrent file is a bencoded dictionary, anything else is an error page or the captcha
+    if r.status_code != 200 or not r.content.startswith(b'd'):
+        raise ValueError(f'{url} is not a torrent file (status {r.status_code}, {r.headers.get("Content-Type", "no content type")})')
+    path = os.path.join(directory, torrent_filename(url))
+    tmp_path = f'{path}.{os.getpid()}.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(r.content)
+    os.replace(tmp_path, path)
+    return path
+
+
+def download_torrents(urls, directory, session, concurrency=4, log=print):
+    """download the .torrent files of urls into directory, at most `concurrency` at a time.
+    Returns {url: path}, the failed downloads are logged and left out"""
+    from tqdm import tqdm
+
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+
+    def fetch(url):
+        try:
+            paths[url] = download_torrent(url, directory, session)
+        except (OSError, ValueError) as e:  # requests' errors are OSErrors
+            log('could not download', url, e)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(int(concurrency), len(urls) or 1))) as executor:
+        list(tqdm(executor.map(fetch, urls), 'downloading', total=len(urls), file=sys.stderr))
+    return paths
+
+
+def send_magnets(magnets, command, timeout=10, log=print):
+    """run the client `command` with the magnets as its last arguments, once (or a few times if they don't fit on one command line).
+    Returns the exit codes, None for a command still running after `timeout` seconds (a GUI client that was just started)
+    and -1 for a command that couldn't be started, which is logged"""
+    args = shlex.split(command)
+    batches, batch, length = [], [], 0
+    for magnet in magnets:
+        if batch and length + len(magnet) > MAX_COMMAND_CHARS:
+            batches.append(batch)
+            batch, length = [], 0
+        batch.append(magnet)
+        length += len(magnet) + 1
+    if batch:
+        batches.append(batch)
+    codes = []
+    for batch in batches:
+        try:
+            process = subprocess.Popen(args + batch)
+        except OSError as e:  # a mistyped or missing client
+            log('could not run', repr(command), e)
+            codes.append(-1)
+            continue
+        try:
+            codes.append(process.wait(timeout))
+        except subprocess.TimeoutExpired:
+            codes.append(None)
+    return codes
+
+
+def write_magnets(magnets, watch_dir):
+    """write each magnet as a .magnet file (named by its info-hash) into a client's watch folder, returns the paths"""
+    os.makedirs(watch_dir, exist_ok=True)
+    paths = []
+    for magnet in magnets:
+        path = os.path.join(watch_dir, (hash_from_magnet(magnet) or str(abs(hash(magnet)))) + '.magnet')
+        tmp_path = path + '.part'  # the client must not pick up a partial file
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            f.write(magnet + '\n')
+        os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
+
+
+def dispatch(dicts, session=None, torrent_dir=None, magnet_command=None, watch_dir=None, concurrency=4, log=print):
+    """hand the torrent dicts (as output by the CLI) over: to torrent_dir, magnet_command and/or watch_dir,
+    or to the browser when none is given"""
+    magnets = [d['magnet'] for d in dicts if d['magnet']]
+    if torrent_dir:
+        own_session = session is None
+        if own_session:
+            session = Session(CookieManager(COOKIES_PATH, log=log).load(), pool_maxsize=concurrency)
+        try:
+            paths = download_torrents([d['torrent'] for d in dicts], torrent_dir, session, concurrency, log)
+        finally:
+            if own_session:
+                session.close()
+        log(f'{len(paths)}/{len(dicts)} torrent files saved in {torrent_dir}')
+    if magnet_command and magnets:
+        failed = sum(1 for code in send_magnets(magnets, magnet_command, log=log) if code)
+        log(f'{len(magnets)} magnets sent to {magnet_command!r}' + (f', {failed} calls failed' if failed else ''))
+    if watch_dir and magnets:
+        log(f'{len(write_magnets(magnets, watch_dir))} magnets written to {watch_dir}')
+    if not (torrent_dir or magnet_command or watch_dir):
+        import asyncio
+
+        asyncio.run(open_torrentfiles([d['torrent'] for d in dicts]))
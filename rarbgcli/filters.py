@@ -0,0 +1,160 @@
+"""
+filtering and ranking of the scraped torrents, applied to the TorrentRecords before they're rendered to dicts,
+so sizes and dates compare as the integers they are (not as the formatted '1.50 GB' strings) and the magnet links of
+torrents that are filtered out are never resolved.
+
+The records are turned into columns once and every criterion is a pass over one column, the combined mask picks the rows.
+With numpy installed (optional) and enough rows, the integer columns are compared as arrays.
+
+    torrent_filter = TorrentFilter(min_seeders=10, max_size=parse_size_arg('4GB'), exclude=['cam', 'hdts'])
+    records = rank(torrent_filter.apply(records), ['seeders', '+size'])
+"""
+
+import re
+import time
+from datetime import datetime
+
+from rarbgcli import size_units
+from rarbgcli.record import TorrentRecord
+
+# the keys that can be ranked by, descending unless prefixed with '+'
+SORT_KEYS = ['title', 'date', 'size', 'seeders', 'leechers']
+NUMERIC_KEYS = {'date', 'size', 'seeders', 'leechers'}
+# below this many rows the arrays cost more than they save
+VECTORIZE_MIN_ROWS = 2000
+
+_numpy = None
+
+
+def _np(n_rows):
+    """numpy if it's installed and worth it for n_rows, else None. Imported on first use only, it's slow to import"""
+    global _numpy
+    if n_rows < VECTORIZE_MIN_ROWS:
+        return None
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+def parse_size_arg(text):
+    """'700MB', '1.5 gb', '2000' (bytes) -> bytes"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d*)?)\s*([kmgtpezy]?b)?\s*', text, re.IGNORECASE)
+    if not match:
+        raise ValueError(f'invalid size {text!r}, expected something like 700MB or 1.5GB')
+    return int(float(match[1]) * size_units[(match[2] or 'B').upper()])
+
+
+def parse_time_arg(text, now=None):
+    """'2022-05-31' (or any ISO date/datetime, local time), or an age: '12h', '7d', '2w' -> unix timestamp"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d*)?)\s*([hdw])\s*', text, re.IGNORECASE)
+    if match:
+        hours = float(match[1]) * {'h': 1, 'd': 24, 'w': 24 * 7}[match[2].lower()]
+        return int((time.time() if now is None else now) - hours * 3600)
+    try:
+        return int(datetime.fromisoformat(text.strip()).timestamp())
+    except ValueError:
+        raise ValueError(f'invalid date {text!r}, expected YYYY-MM-DD or an age like 12h, 7d, 2w')
+
+
+def parse_sort_key(text):
+    """'size' (descending) or '+size' (ascending) -> (field, descending)"""
+    field, descending = (text[1:], False) if text.startswith('+') else (text, True)
+    if field not in SORT_KEYS:
+        raise ValueError(f'invalid sort key {text!r}, choices are: {SORT_KEYS} (prefixed with + for ascending)')
+    return field, descending
+
+
+def columns(records):
+    """{field: column} of a list of TorrentRecords"""
+    return dict(zip(TorrentRecord._fields, zip(*records))) if records else {field: () for field in TorrentRecord._fields}
+
+
+class TorrentFilter:
+    """the criteria a torrent must all meet, the ones left as None/empty aren't checked.
+    Sizes are in bytes and dates are unix timestamps, both inclusive. `include` patterns must all match the title,
+    none of the `exclude` patterns may match it (case insensitive regexes). `uploaders` is a set of accepted uploaders"""
+
+    def __init__(self, min_seeders=None, min_size=None, max_size=None, since=None, until=None, include=(), exclude=(), uploaders=()):
+        self.min_seeders = min_seeders
+        self.min_size = min_size
+        self.max_size = max_size
+        self.since = since
+        self.until = until
+        self.include = [re.compile(pattern, re.IGNORECASE) for pattern in include]
+        self.exclude = re.compile('|'.join(f'(?:{pattern})' for pattern in exclude), re.IGNORECASE) if exclude else None
+        self.uploaders = {uploader.lower() for uploader in uploaders}
+
+    def __bool__(self):
+        bounds = (self.min_seeders, self.min_size, self.max_size, self.since, self.until, self.exclude)
+        return any(value is not None for value in bounds) or bool(self.include or self.uploaders)
+
+    def _ranges(self):
+        """(field, low, high) of the numeric criteria"""
+        ranges = [('seeders', self.min_seeders, None), ('size', self.min_size, self.max_size), ('date', self.since, self.until)]
+        return [(field, low, high) for field, low, high in ranges if low is not None or high is not None]
+
+    def mask(self, records):
+        """a bool per record, True for the ones that meet every criterion"""
+        records = list(records)
+        cols = columns(records)
+        np = _np(len(records))
+        if np is not None:
+            mask = np.ones(len(records), dtype=bool)
+            for field, low, high in self._ranges():
+                column = np.fromiter(cols[field], dtype=np.int64, count=len(records))
+                if low is not None:
+                    mask &= column >= low
+                if high is not None:
+                    mask &= column <= high
+            for keep in self._text_masks(cols):
+                mask &= np.fromiter(keep, dtype=bool, count=len(records))
+            return mask.tolist()
+
+        mask = [True] * len(records)
+        for field, low, high in self._ranges():
+            low = float('-inf') if low is None else low
+            high = float('inf') if high is None else high
+            mask = [keep and low <= value <= high for keep, value in zip(mask, cols[field])]
+        for column_mask in self._text_masks(cols):
+            mask = [keep and ok for keep, ok in zip(mask, column_mask)]
+        return mask
+
+    def _text_masks(self, cols):
+        for pattern in self.include:
+            yield [pattern.search(title) is not None for title in cols['title']]
+        if self.exclude is not None:
+            yield [self.exclude.search(title) is None for title in cols['title']]
+        if self.uploaders:
+            yield [uploader.lower() in self.uploaders for uploader in cols['uploader']]
+
+    def apply(self, records):
+        """the records that meet every criterion, in the same order"""
+        records = list(records)
+        if not self:
+            return records
+        return [record for record, keep in zip(records, self.mask(records)) if keep]
+
+
+def rank(records, keys):
+    """records sorted by several keys: ['seeders', '+size'] is most seeders first, then smallest first.
+    Sorting is stable, records equal on every key keep their order"""
+    records = list(records)
+    keys = [parse_sort_key(key) if isinstance(key, str) else key for key in keys if key]
+    if not keys or len(records) < 2:
+        return records
+    cols = columns(records)
+    np = _np(len(records))
+    order = np.arange(len(records)) if np is not None else list(range(len(records)))
+    # one stable pass per key, the least significant first
+    for field, descending in reversed(keys):
+        if np is not None and field in NUMERIC_KEYS:
+            column = np.fromiter(cols[field], dtype=np.int64, count=len(records))[order]
+            order = order[np.argsort(-column if descending else column, kind='stable')]
+        else:
+            order = sorted(order, key=cols[field].__getitem__, reverse=descending)
+            order = np.asarray(order) if np is not None else order
+    return [records[i] for i in order]
@@ -0,0 +1,132 @@
+"""
+per host rate limiting and mirror failover for rarbgcli.session.Session.
+
+Every host gets a token bucket (when a rate is set) and a running estimate of its latency and error rate.
+A host answering 429/503 (or not at all) is put on a cooldown that doubles with each consecutive failure
+(or lasts its Retry-After) and its rate is halved, then raised back step by step as its requests succeed.
+Requests to one of the mirrors are routed to the healthiest mirror and fail over to the next one on errors,
+only the host of the url changes, so the output urls (built from the primary --domain) stay the same.
+"""
+
+import threading
+import time
+from urllib.parse import urlparse
+
+# statuses after which a request is sent to another mirror
+FAILOVER_STATUSES = (429, 500, 502, 503, 504)
+# statuses that mean the host wants less traffic
+THROTTLE_STATUSES = (429, 503)
+
+
+class HostState:
+    """what's known about one host"""
+
+    def __init__(self, rate=None):
+        self.base_rate = rate  # requests per second, None for no limit
+        self.rate = rate
+        self.tokens = 1.0
+        self.refilled = time.monotonic()
+        self.cooldown_until = 0.0
+        self.failures_in_a_row = 0
+        self.latency = None  # moving average, seconds
+        self.error_rate = 0.0  # moving average
+        self.requests = 0
+        self.errors = 0
+
+    def score(self):
+        """lower is healthier: slow hosts and failing hosts rank last, hosts not tried yet first"""
+        return (self.latency or 0.0) * (1 + 4 * self.error_rate)
+
+
+class HostScheduler:
+    def __init__(self, mirrors=(), rate=None, min_rate=0.1, max_cooldown=60, smoothing=0.2):
+        self.mirrors = [mirror.strip() for mirror in mirrors]
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_cooldown = max_cooldown
+        self.smoothing = smoothing
+        self.hosts = {}  # host -> HostState
+        self._lock = threading.Lock()
+
+    def _state(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = HostState(self.rate)
+        return self.hosts[host]
+
+    def pick(self, url, exclude=()):
+        """the host to send `url` to: the healthiest mirror not in `exclude` if it's a mirror url, its own host otherwise"""
+        host = urlparse(url).netloc
+        if host not in self.mirrors:
+            return host
+        candidates = [mirror for mirror in self.mirrors if mirror not in exclude] or [host]
+        now = time.monotonic()
+        with self._lock:
+            # in list order among equals, so the primary mirror comes first
+            return min(candidates, key=lambda mirror: (self._state(mirror).cooldown_until > now, self._state(mirror).score()))
+
+    def has_alternative(self, url, tried):
+        """whether a mirror that wasn't tried yet can serve `url`"""
+        return urlparse(url).netloc in self.mirrors and any(mirror not in tried for mirror in self.mirrors)
+
+    @staticmethod
+    def route(url, host):
+        parts = urlparse(url)
+        return url if parts.netloc == host else parts._replace(netloc=host).geturl()
+
+    def acquire(self, host):
+        """wait until `host` is out of its cooldown and has a token for one more request"""
+        while True:
+            with self._lock:
+                state = self._state(host)
+                now = time.monotonic()
+                if state.rate:
+                    state.tokens = min(1.0, state.tokens + (now - state.refilled) * state.rate)
+                    state.refilled = now
+                if state.cooldown_until > now:
+                    wait = state.cooldown_until - now
+                elif state.rate and state.tokens < 1:
+                    wait = (1 - state.tokens) / state.rate
+                else:
+                    if state.rate:
+                        state.tokens -= 1
+                    return
+            time.sleep(wait)
+
+    def report(self, host, elapsed, status=None, error=None, retry_after=None):
+        """record the outcome of a request to `host`: its `status`, or the `error` it raised"""
+        failed = error is not None or status in FAILOVER_STATUSES
+        with self._lock:
+            state = self._state(host)
+            state.requests += 1
+            state.errors += failed
+            state.error_rate += self.smoothing * (failed - state.error_rate)
+            if error is None:
+                state.latency = elapsed if state.latency is None else state.latency + self.smoothing * (elapsed - state.latency)
+
+            if error is not None or status in THROTTLE_STATUSES:
+                state.failures_in_a_row += 1
+                try:
+                    cooldown = float(retry_after)
+                except (TypeError, ValueError):  # missing, or an HTTP date
+                    cooldown = 0.5 * 2 ** (state.failures_in_a_row - 1)
+                state.cooldown_until = time.monotonic() + min(cooldown, self.max_cooldown)
+                if state.rate:
+                    state.rate = max(self.min_rate, state.rate / 2)
+            elif not failed:
+                state.failures_in_a_row = 0
+                if state.base_rate and state.rate < state.base_rate:
+                    state.rate = min(state.base_rate, state.rate + state.base_rate / 10)
+
+    def stats(self):
+        """{host: {'requests', 'errors', 'latency', 'error_rate', 'rate'}}"""
+        with self._lock:
+            return {
+                host: {
+                    'requests': state.requests,
+                    'errors': state.errors,
+                    'latency': state.latency,
+                    'error_rate': state.error_rate,
+                    'rate': state.rate,
+                }
+                for host, state in self.hosts.items()
+            }
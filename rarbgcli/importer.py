@@ -0,0 +1,135 @@
+"""
+rarbg import-history - load what older versions left in ~/.rarbgcli into the torrent store, so --offline searches
+find it: the per-query history/*.json result files and the history/*_torrents_<i>.html page dumps (and the pages
+of the archive). No query is recorded, online searches still fetch their pages once.
+
+    $ rarbg import-history
+    $ rarbg import-history path/to/history other/dir/page.html --workers 8
+
+The files are parsed in parallel by a pool of processes, the torrents are deduplicated by info-hash (falling back
+to the page path) and written in batches, one transaction each. Torrents already in the store are kept as they are,
+unless --overwrite. The history files only kept the category name, the category code of a page wins over it.
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+
+from rarbgcli import CATEGORY2CODE, CODE2CATEGORY, PROGRAM_HOME, hash_from_magnet, parse_size, pprint
+from rarbgcli.archive import ARCHIVE_DIR
+from rarbgcli.parser import BACKENDS, DEFAULT_BACKEND, parse_listing
+from rarbgcli.record import TorrentIndex, TorrentRecord, hash_to_bytes
+from rarbgcli.store import STORE_PATH, TorrentStore
+
+HISTORY_DIR = os.path.join(PROGRAM_HOME, 'history')
+# the history files only kept the category name, any code of it will do for the category filters
+CATEGORY2FIRST_CODE = {category: codes[0] for category, codes in CATEGORY2CODE.items() if codes}
+# 'UNKOWN' (games, ebooks...) is any category without a name, a code of those keeps them in the nonxxx results
+UNKNOWN_CODE = next(code for code in CATEGORY2CODE['nonxxx'] if code not in CODE2CATEGORY)
+
+
+def find_files(paths):
+    """the importable files under paths (directories or files), oldest first so newer values win the deduplication"""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(glob.glob(os.path.join(path, '*.json')))
+            files.update(glob.glob(os.path.join(path, '*_torrents_*.html')))
+            files.update(glob.glob(os.path.join(path, 'objects', '*', '*.html.gz')))  # an archive
+        elif os.path.exists(path):
+            files.add(path)
+    return sorted(files, key=os.path.getmtime)
+
+
+def record_from_dict(d):
+    """a torrent dict of a history file (as output by the CLI) back to a TorrentRecord"""
+    return TorrentRecord(
+        title=d['title'],
+        path=urlparse(d['href']).path,
+        info_hash=hash_to_bytes(hash_from_magnet(d.get('magnet'))),
+        date=int(float(d.get('date') or 0)),
+        category_code=CATEGORY2FIRST_CODE.get(d.get('category'), UNKNOWN_CODE),
+        size=parse_size(d['size']) if isinstance(d.get('size'), str) else int(d.get('size') or 0),
+        seeders=int(d.get('seeders') or 0),
+        leechers=int(d.get('leechers') or 0),
+        uploader=str(d.get('uploader') or ''),
+    )
+
+
+def parse_file(path, parser=DEFAULT_BACKEND):
+    """(records, error) of one file, runs in the worker processes"""
+    try:
+        if path.endswith('.json'):
+            with open(path, 'r', encoding='utf8') as f:
+                return [record_from_dict(d) for d in json.load(f)], None
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as f:
+            return parse_listing(f.read(), backend=parser), None
+    except (OSError, ValueError, KeyError, TypeError) as e:  # json errors are ValueErrors
+        return [], f'{type(e).__name__}: {e}'
+
+
+def import_history(paths, store, workers=None, batch_size=5000, overwrite=False, parser=DEFAULT_BACKEND, log=pprint):
+    """parse the files under paths in a process pool and write their torrents to the store, returns (files, torrents, errors)"""
+    from tqdm import tqdm
+
+    files = find_files(paths)
+    index = TorrentIndex()
+    page_codes = {}  # path -> category code of the torrents seen on a page, exact where the history files guess
+    errors = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # big chunks, each file is quick to parse and there can be tens of thousands of them
+        chunksize = max(1, min(256, len(files) // (4 * (workers or os.cpu_count() or 1)) or 1))
+        results = executor.map(parse_file, files, [parser] * len(files), chunksize=chunksize)
+        for path, (records, error) in tqdm(zip(files, results), 'parsing', total=len(files), unit='file', file=sys.stderr):
+            if error is not None:
+                errors += 1
+                log(f'skipping {path}: {error}')
+            index.add(records)
+            if not path.endswith('.json'):
+                page_codes.update((record.path, record.category_code) for record in records)
+
+    records = [record._replace(category_code=page_codes.get(record.path) or record.category_code) for record in index]
+    with tqdm(total=len(records), desc='importing', unit='torrent', file=sys.stderr) as progress:
+        for start in range(0, len(records), batch_size):
+            batch = records[start : start + batch_size]
+            # when they were scraped isn't known, updated=0 keeps them from passing for fresh results
+            store.upsert(batch, overwrite=overwrite, updated=0)
+            progress.update(len(batch))
+    return len(files), len(records), errors
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser('rarbg import-history', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'paths',
+        nargs='*',
+        default=[HISTORY_DIR, ARCHIVE_DIR],
+        help='Directories (history, archive) and files to import (default: ~/.rarbgcli/history and ~/.rarbgcli/archive)',
+    )
+    parser.add_argument('--workers', type=int, default=None, help='Number of parsing processes (default: one per core)')
+    parser.add_argument('--batch_size', type=int, default=5000, help='Torrents written per transaction')
+    parser.add_argument('--overwrite', action='store_true', help='Replace the torrents already in the store with the imported values')
+    parser.add_argument('--store', default=STORE_PATH, help='Path of the torrent store')
+    parser.add_argument('--parser', choices=BACKENDS, default=DEFAULT_BACKEND, help='HTML parser backend for the pages')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = get_args(argv)
+    if (args.workers is not None and args.workers < 1) or args.batch_size < 1:
+        print('--workers and --batch_size must be at least 1', file=sys.stderr)
+        return 1
+    with TorrentStore(args.store) as store:
+        files, torrents, errors = import_history(args.paths, store, args.workers, args.batch_size, args.overwrite, args.parser)
+    pprint(f'{torrents} torrents imported from {files} files into {args.store}' + (f', {errors} files skipped' if errors else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,68 @@
+"""
+lightweight instrumentation of a run: wall time per stage and counters, shared by every thread of the process.
+
+    with METRICS.stage('parse'):
+        rows = parse_listing(html)
+    METRICS.count('rows_parsed', len(rows))
+
+Stage times are summed over the threads, so with concurrent fetches a stage can add up to more than the run's wall time.
+`rarbg --profile` prints the report to stderr at the end of the run.
+"""
+
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}  # name -> [calls, seconds]
+            self.counters = Counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stage = self.stages.setdefault(name, [0, 0.0])
+                stage[0] += 1
+                stage[1] += elapsed
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def report(self):
+        with self._lock:
+            return {
+                'stages': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+    def format_table(self):
+        report = self.report()
+        lines = [f"{'stage':24} {'calls':>8} {'seconds':>10}"]
+        for name, stage in sorted(report['stages'].items(), key=lambda item: -item[1]['seconds']):
+            lines.append(f"{name:24} {stage['calls']:>8} {stage['seconds']:>10.3f}")
+        lines.append('')
+        lines.append(f"{'counter':24} {'value':>8}")
+        for name, value in sorted(report['counters'].items()):
+            lines.append(f'{name:24} {value:>8}')
+        return '\n'.join(lines)
+
+    def format_json(self):
+        return json.dumps(self.report(), indent=4)
+
+
+# the metrics of the process, everything records into it
+METRICS = Metrics()
@@ -0,0 +1,147 @@
+"""
+single pass parser for the torrents.php listing pages.
+
+Every `tr.lista2` row is turned into a rarbgcli.record.TorrentRecord of raw values
+(page path, binary info-hash taken from the thumbnail, timestamp, size in bytes, ...)
+
+Backends:
+    stream       stdlib html.parser tokenizer, no tree is built at all (default)
+    lxml         BeautifulSoup on lxml, only the rows are built
+    html.parser  BeautifulSoup on html.parser, only the rows are built
+"""
+
+import datetime
+from html.parser import HTMLParser
+
+from rarbgcli import THUMBNAIL_HASH_REGEX, parse_size
+from rarbgcli.metrics import METRICS
+from rarbgcli.record import TorrentRecord, hash_to_bytes
+
+BACKENDS = ['stream', 'lxml', 'html.parser']
+DEFAULT_BACKEND = 'stream'
+
+# column of each field in a listing row (0 based)
+CATEGORY_COLUMN = 0
+TITLE_COLUMN = 1
+DATE_COLUMN = 2
+SIZE_COLUMN = 3
+SEEDERS_COLUMN = 4
+LEECHERS_COLUMN = 5
+UPLOADER_COLUMN = 7
+
+
+def make_row(title, href, onmouseover, date, category_src, size, seeders, leechers, uploader):
+    match = THUMBNAIL_HASH_REGEX.search(onmouseover or '')
+    return TorrentRecord(
+        title=title,
+        path=href,
+        info_hash=hash_to_bytes(match[1]) if match else b'',
+        date=int(datetime.datetime.strptime(date.strip(), '%Y-%m-%d %H:%M:%S').timestamp()),
+        category_code=(category_src or '').split('/')[-1].replace('cat_new', '').replace('.gif', ''),
+        size=parse_size(size),
+        seeders=int(seeders),
+        leechers=int(leechers),
+        uploader=uploader.strip(),
+    )
+
+
+class _ListingTokenizer(HTMLParser):
+    """collects the listing rows while tokenizing, keeps only the state of the current row"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self._row = None  # None when outside a tr.lista2
+
+    def _end_row(self):
+        row, self._row = self._row, None
+        if row is None or row['anchor'] is None:
+            return
+        cells = row['cells']
+        self.rows.append(
+            make_row(
+                title=row['anchor']['title'],
+                href=row['anchor']['href'],
+                onmouseover=row['anchor'].get('onmouseover'),
+                date=''.join(cells[DATE_COLUMN]),
+                category_src=row['category_src'],
+                size=''.join(cells[SIZE_COLUMN]),
+                seeders=''.join(cells[SEEDERS_COLUMN]),
+                leechers=''.join(cells[LEECHERS_COLUMN]),
+                uploader=''.join(cells[UPLOADER_COLUMN]),
+            )
+        )
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._end_row()
+            if 'lista2' in (dict(attrs).get('class') or '').split():
+                self._row = {'cells': [], 'anchor': None, 'category_src': None}
+        elif self._row is None:
+            return
+        elif tag == 'td':
+            self._row['cells'].append([])
+        elif tag == 'img' and len(self._row['cells']) - 1 == CATEGORY_COLUMN and self._row['category_src'] is None:
+            self._row['category_src'] = dict(attrs).get('src')
+        elif tag == 'a' and len(self._row['cells']) - 1 == TITLE_COLUMN and self._row['anchor'] is None:
+            attrs = dict(attrs)
+            if (attrs.get('href') or '').startswith('/torrent/') and attrs.get('title') is not None:
+                self._row['anchor'] = attrs
+
+    def handle_endtag(self, tag):
+        if tag in ('tr', 'table'):
+            self._end_row()
+
+    def handle_data(self, data):
+        if self._row is not None and self._row['cells']:
+            self._row['cells'][-1].append(data)
+
+    def close(self):
+        super().close()
+        self._end_row()
+
+
+def _parse_stream(html):
+    tokenizer = _ListingTokenizer()
+    tokenizer.feed(html)
+    tokenizer.close()
+    return tokenizer.rows
+
+
+def _parse_soup(html, features):
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    rows = []
+    soup = BeautifulSoup(html, features, parse_only=SoupStrainer('tr', class_='lista2'))
+    for tr in soup.find_all('tr', class_='lista2'):
+        cells = tr.find_all('td', recursive=False)
+        anchor = cells[TITLE_COLUMN].find(lambda tag: tag.name == 'a' and tag.get('href', '').startswith('/torrent/') and tag.has_attr('title'))
+        if anchor is None:
+            continue
+        category_img = cells[CATEGORY_COLUMN].find('img')
+        rows.append(
+            make_row(
+                title=anchor.get('title'),
+                href=anchor.get('href'),
+                onmouseover=anchor.get('onmouseover'),
+                date=cells[DATE_COLUMN].get_text(),
+                category_src=category_img.get('src') if category_img else None,
+                size=cells[SIZE_COLUMN].get_text(),
+                seeders=cells[SEEDERS_COLUMN].get_text(),
+                leechers=cells[LEECHERS_COLUMN].get_text(),
+                uploader=cells[UPLOADER_COLUMN].get_text(),
+            )
+        )
+    return rows
+
+
+def parse_listing(html, backend=DEFAULT_BACKEND):
+    """returns the TorrentRecords found in a listing page, in page order"""
+    if backend not in BACKENDS:
+        raise ValueError(f'unknown parser backend {backend!r}, choices are: {BACKENDS}')
+    with METRICS.stage('parse'):
+        if isinstance(html, bytes):
+            html = html.decode('utf-8', errors='replace')
+        rows = _parse_stream(html) if backend == 'stream' else _parse_soup(html, backend)
+    METRICS.count('rows_parsed', len(rows))
+    return rows
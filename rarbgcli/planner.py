@@ -0,0 +1,79 @@
+"""
+decides how many result pages a query needs, so pagination stops (and stops prefetching) once --limit is met
+instead of running to the first empty page.
+
+The site returns ROWS_PER_PAGE torrents per page: a limit of N needs ceil(N / 25) pages, counted over every page so far.
+With filters, the pages still needed are estimated from the share of rows kept until now.
+A --sort needs every page, unless the site's --order/--sort_order already lists the torrents in that order:
+then the top N are the first N, and they're settled as soon as they're fetched.
+"""
+
+import math
+
+from rarbgcli.filters import parse_sort_key
+from rarbgcli.store import ORDER_COLUMNS
+
+ROWS_PER_PAGE = 25
+
+
+def sorted_by_order(sort, order='', sort_order=None):
+    """whether the site's ordering already lists the torrents by the first --sort key"""
+    if not sort or not order:
+        return False
+    field, descending = parse_sort_key(sort[0]) if isinstance(sort[0], str) else sort[0]
+    return field == ORDER_COLUMNS[order] and descending == ((sort_order or '').lower() != 'asc')
+
+
+class PagePlanner:
+    """fed the torrents of each page (the ones that count towards the limit: deduplicated and filtered),
+    tells the last page worth requesting and when the pagination is done"""
+
+    def __init__(self, limit=float('inf'), sort=(), order='', sort_order=None, rows_per_page=ROWS_PER_PAGE):
+        self.limit = limit
+        self.sort = [parse_sort_key(key) if isinstance(key, str) else key for key in sort if key]
+        self.ordered = sorted_by_order(self.sort, order, sort_order)
+        self.rows_per_page = rows_per_page
+        self.pages = 0
+        self.rows = 0  # every row of the pages so far
+        self.kept = 0  # the ones that count towards the limit
+        self._boundary = None  # value of the first sort key of the limit-th torrent
+        self._last = None  # value of the first sort key of the last torrent so far
+
+    @property
+    def bounded(self):
+        """whether the limit bounds the pages at all"""
+        return self.limit < float('inf') and (not self.sort or self.ordered)
+
+    def add(self, records, rows=None):
+        """account for one more page, `rows` is its row count before deduplication and filtering (defaults to len(records))"""
+        records = list(records)
+        self.pages += 1
+        self.rows += len(records) if rows is None else rows
+        if self.ordered and records:
+            field = self.sort[0][0]
+            if self.kept < self.limit <= self.kept + len(records):
+                self._boundary = getattr(records[int(self.limit) - self.kept - 1], field)
+            self._last = getattr(records[-1], field)
+        self.kept += len(records)
+
+    def done(self):
+        """whether the pages so far are enough for the limit"""
+        if not self.bounded or self.kept < self.limit:
+            return False
+        # torrents tying on the first key with the limit-th one may still rank above it by the other keys
+        return len(self.sort) <= 1 or self._last != self._boundary
+
+    def last_page(self):
+        """the last page number worth requesting given what's known now, None for no bound"""
+        if not self.bounded:
+            return None
+        if self.done():
+            return self.pages
+        missing = max(1, self.limit - self.kept)
+        if self.rows and self.kept < self.rows:  # not every row counts, estimate from the share kept so far
+            if not self.kept:
+                return None
+            per_page = self.rows_per_page * self.kept / self.rows
+        else:
+            per_page = self.rows_per_page
+        return self.pages + math.ceil(missing / per_page)
@@ -9,23 +9,29 @@ Example usage:
 https://github.com/FarisHijazi/rarbgcli
 
 """
-# TODO: turn this lib into an API lib (keep the CLI as a bonus)
 
 import argparse
-import asyncio
-import datetime
+import importlib
 import json
 import os
+import re
 import sys
-from functools import partial
-from urllib.parse import quote
 
-import requests
-import yaml
-from bs4 import BeautifulSoup
+from rarbgcli import CATEGORY2CODE, size_units, unique, \
+    real_print, pprint, COOKIES_PATH
+from rarbgcli.api import collect_torrents, iter_batch, iter_torrent_pages, resolve_torrents, stored_torrents
+from rarbgcli.archive import PageArchive
+from rarbgcli.cookies import CookieManager
+from rarbgcli.dispatch import dispatch
+from rarbgcli.filters import SORT_KEYS, TorrentFilter, parse_size_arg, parse_sort_key, parse_time_arg, rank
+from rarbgcli.metrics import METRICS
+from rarbgcli.parser import BACKENDS, DEFAULT_BACKEND
+from rarbgcli.record import TorrentKeys
+from rarbgcli.session import Session
+from rarbgcli.store import TorrentStore, search_offline
 
-from rarbgcli import CATEGORY2CODE, dict_to_fname, get_page_html, extract_magnet, extract_torrent_file, CODE2CATEGORY, \
-    format_size, size_units, load_cookies, unique, open_torrentfiles, real_print, PROGRAM_HOME, parse_size
+# status messages go to stderr when piped so stdout only has the results (printed with real_print)
+print = pprint
 
 
 def get_user_input_interactive(torrent_dicts, start_index=0):
@@ -78,16 +84,30 @@ def get_user_input_interactive(torrent_dicts, start_index=0):
 
 def get_args():
     orderkeys = ['data', 'filename', 'leechers', 'seeders', 'size', '']
-    sortkeys = ['title', 'date', 'size', 'seeders', 'leechers', '']
     parser = argparse.ArgumentParser(__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     # parser = parser.add_argument_group("Query")
-    parser.add_argument('search', help='Search term')
+    parser.add_argument('search', nargs='?', default=None, help='Search term (not used with --batch)')
+    parser.add_argument(
+        '--batch',
+        metavar='FILE',
+        default=None,
+        help='Run every search of FILE (one per line, - for stdin) over one session, '
+        'results are output as ndjson tagged with their "query" as each search finishes',
+    )
     parser.add_argument('--category', '-c', choices=CATEGORY2CODE.keys(), default='nonxxx')
     parser.add_argument(
         '--domain',
         default='rarbgunblocked.org',
         help='Domain to search, you could put an alternative mirror domain here',
     )
+    parser.add_argument(
+        '--mirrors',
+        nargs='+',
+        metavar='DOMAIN',
+        default=[],
+        help='Other mirrors of --domain: pages are fetched from the fastest healthy one, failing over on errors. '
+        'Output links always use --domain',
+    )
     parser.add_argument(
         '--order',
         '-r',
@@ -108,9 +128,11 @@ def get_args():
     output_group.add_argument(
         '--sort',
         '-s',
-        choices=sortkeys,
-        default='',
-        help='Sort results (after scraping) by this key. empty string means no sort',
+        action='append',
+        metavar='KEY[,KEY...]',
+        default=[],
+        help=f'Sort results (after scraping) by this key, descending, or ascending when prefixed with +. '
+        f'Repeat it or separate the keys with commas to break ties. Keys are: {SORT_KEYS}',
     )
     output_group.add_argument('--limit', '-l', type=float, default='inf', help='Limit number of torrent magnet links')
     output_group.add_argument(
@@ -125,7 +147,27 @@ def get_args():
         '-d',
         action='store_true',
         default=None,
-        help='Open torrent files in browser (which will download them)',
+        help='Open torrent files in browser (which will download them), or hand them to --torrent_dir, --magnet_command, --watch_dir',
+    )
+    output_group.add_argument(
+        '--torrent_dir', metavar='DIR', default=None, help='Download the .torrent files into DIR (concurrently, over the same connection)'
+    )
+    output_group.add_argument(
+        '--magnet_command',
+        metavar='CMD',
+        default=None,
+        help='Run CMD once with all the magnet links as arguments, e.g. "qbittorrent" or "transmission-remote -a"',
+    )
+    output_group.add_argument(
+        '--watch_dir', metavar='DIR', default=None, help="Write the magnet links as .magnet files into a torrent client's watch folder"
+    )
+    output_group.add_argument(
+        '--format',
+        '-f',
+        dest='output_format',
+        choices=['json', 'ndjson'],
+        default='json',
+        help='json: one array at the end. ndjson: one torrent per line, printed as soon as its page is parsed (unless --sort is used)',
     )
     output_group.add_argument(
         '--block_size',
@@ -137,33 +179,287 @@ def get_args():
         help='Display torrent sizes in SIZE unit. Choices are: ' + str(set(list(size_units.keys()))),
     )
 
+    filter_group = parser.add_argument_group('Filters', 'Applied to the scraped torrents before sorting, limiting and resolving magnets')
+    filter_group.add_argument('--min_seeders', type=int, default=None, metavar='N', help='Only torrents with at least N seeders')
+    filter_group.add_argument('--min_size', type=parse_size_arg, default=None, metavar='SIZE', help='Only torrents of at least SIZE (e.g. 700MB)')
+    filter_group.add_argument('--max_size', type=parse_size_arg, default=None, metavar='SIZE', help='Only torrents of at most SIZE (e.g. 4GB)')
+    filter_group.add_argument(
+        '--since', type=parse_time_arg, default=None, metavar='DATE', help='Only torrents added since DATE: YYYY-MM-DD or an age like 12h, 7d, 2w'
+    )
+    filter_group.add_argument('--until', type=parse_time_arg, default=None, metavar='DATE', help='Only torrents added until DATE')
+    filter_group.add_argument(
+        '--include', action='append', default=[], metavar='REGEX', help='Only titles matching REGEX (case insensitive), can be repeated'
+    )
+    filter_group.add_argument(
+        '--exclude', action='append', default=[], metavar='REGEX', help='Drop titles matching REGEX (case insensitive), can be repeated'
+    )
+    filter_group.add_argument(
+        '--uploader',
+        action='append',
+        default=[],
+        metavar='NAME',
+        help='Only torrents uploaded by one of these uploaders (repeatable, or comma separated)',
+    )
+
     misc_group = parser.add_argument_group('Miscilaneous')
+    misc_group.add_argument(
+        '--concurrency',
+        '-j',
+        type=int,
+        default=4,
+        help='Number of result pages to fetch in parallel (1 fetches pages one by one), over all the searches with --batch',
+    )
+    misc_group.add_argument(
+        '--rate',
+        type=float,
+        default=None,
+        metavar='N',
+        help='Send at most N requests per second to each host, lowered automatically when a host throttles (default: no limit)',
+    )
     misc_group.add_argument('--no_cache', '-nc', action='store_true',
                             help="Don't use cached results from previous searches")
+    misc_group.add_argument(
+        '--parser',
+        choices=BACKENDS,
+        default=DEFAULT_BACKEND,
+        help='HTML parser backend for the result pages (lxml requires the lxml package)',
+    )
+    misc_group.add_argument(
+        '--cache_ttl',
+        type=float,
+        default=3600,
+        metavar='SECONDS',
+        help='Result pages fetched less than SECONDS ago are taken from the cache instead of fetched again (0 always fetches)',
+    )
+    misc_group.add_argument(
+        '--archive_days',
+        type=float,
+        default=30,
+        metavar='DAYS',
+        help='Keep the raw result pages (compressed, in ~/.rarbgcli/archive) for DAYS days, 0 disables the archive',
+    )
+    misc_group.add_argument(
+        '--offline',
+        '--cache_only',
+        action='store_true',
+        help='Answer the search only from previously scraped torrents, without any network access',
+    )
     misc_group.add_argument(
         '--no_cookie',
         '-nk',
         action='store_true',
         help="Don't use CAPTCHA cookie from previous runs (will need to resolve a new CAPTCHA)",
     )
+    misc_group.add_argument(
+        '--profile',
+        nargs='?',
+        const='table',
+        default=None,
+        choices=['table', 'json'],
+        help='Print the time spent in each stage and counters (bytes, pages, rows, cache hits, captcha solves, retries) to stderr',
+    )
+    misc_group.add_argument(
+        '--profile_with',
+        nargs='+',
+        default=[],
+        choices=['cprofile', 'tracemalloc'],
+        help='With --profile, also run the search under cProfile and/or tracemalloc and print their top entries',
+    )
     args = parser.parse_args()
 
+    if (args.search is None) == (args.batch is None):
+        print('give either a search term or --batch FILE', file=sys.stderr)
+        exit(1)
+    dispatching = args.download_torrents or args.torrent_dir or args.magnet_command or args.watch_dir
+    if args.batch is not None and (args.interactive or dispatching or args.offline):
+        print('--batch can not be used with --interactive, --download_torrents (and its targets) or --offline', file=sys.stderr)
+        exit(1)
+    if dispatching and args.download_torrents is None:
+        args.download_torrents = True  # giving a target is asking for the download
     if args.interactive is None:
-        args.interactive = sys.stdout.isatty()  # automatically decide based on if tty
+        args.interactive = args.batch is None and sys.stdout.isatty()  # automatically decide based on if tty
 
     if args.limit < 1:
         print('--limit must be greater than 1', file=sys.stderr)
         exit(1)
+    if args.concurrency < 1:
+        print('--concurrency must be at least 1', file=sys.stderr)
+        exit(1)
+    if args.rate is not None and not args.rate > 0:  # also NaN
+        print('--rate must be greater than 0', file=sys.stderr)
+        exit(1)
+    if args.offline and args.no_cache:
+        print('--offline and --no_cache can not be used together', file=sys.stderr)
+        exit(1)
     if args.sort_order is not None and not args.order:
         print('--sort_order requires --order', file=sys.stderr)
         exit(1)
+    args.sort = [key.strip() for keys in args.sort for key in keys.split(',') if key.strip()]
+    args.uploader = [name.strip() for names in args.uploader for name in names.split(',') if name.strip()]
+    try:
+        for key in args.sort:
+            parse_sort_key(key)
+        args.torrent_filter = TorrentFilter(
+            *[vars(args).pop(name) for name in ['min_seeders', 'min_size', 'max_size', 'since', 'until', 'include', 'exclude', 'uploader']]
+        )
+    except (ValueError, re.error) as e:
+        print(e, file=sys.stderr)
+        exit(1)
     return args
 
 
+# `rarbg <subcommand> ...` runs the main() of these modules with the remaining arguments
+SUBCOMMANDS = {
+    'bench': 'rarbgcli.bench',
+    'import-history': 'rarbgcli.importer',
+    'serve': 'rarbgcli.server',
+    'solver': 'rarbgcli.solver',
+}
+
+
 def cli():
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        return importlib.import_module(SUBCOMMANDS[sys.argv[1]]).main(sys.argv[2:])
+
     args = get_args()
     print(vars(args))
-    return main(**vars(args), _session_name=dict_to_fname(args))
+    profile, profile_with = vars(args).pop('profile'), vars(args).pop('profile_with')
+    if profile is None:
+        return run(args)
+    return run_profiled(run, args, profile, profile_with)
+
+
+def run(args):
+    batch = vars(args).pop('batch')
+    if batch is not None:
+        return main_batch(
+            read_searches(batch),
+            category=args.category,
+            limit=args.limit,
+            domain=args.domain,
+            mirrors=args.mirrors,
+            order=args.order,
+            sort_order=args.sort_order,
+            magnet=args.magnet,
+            sort=args.sort,
+            torrent_filter=args.torrent_filter,
+            no_cache=args.no_cache,
+            no_cookie=args.no_cookie,
+            block_size=args.block_size,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            parser=args.parser,
+            cache_ttl=args.cache_ttl,
+        )
+    return main(**vars(args))
+
+
+def run_profiled(func, args, output_format='table', profile_with=()):
+    """func(args) with its stages and counters recorded, the report goes to stderr"""
+    METRICS.reset()
+    profiler = None
+    if 'cprofile' in profile_with:
+        import cProfile
+
+        profiler = cProfile.Profile()
+    if 'tracemalloc' in profile_with:
+        import tracemalloc
+
+        tracemalloc.start()
+    try:
+        with METRICS.stage('total'):
+            if profiler is not None:
+                profiler.enable()
+            try:
+                return func(args)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    finally:
+        report = METRICS.format_json() if output_format == 'json' else METRICS.format_table()
+        real_print(report, file=sys.stderr)
+        if profiler is not None:
+            import pstats
+
+            real_print('\ncProfile, top 25 by cumulative time:', file=sys.stderr)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+        if 'tracemalloc' in profile_with:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            real_print(f'\ntracemalloc: current {current / 2**20:.1f} MiB, peak {peak / 2**20:.1f} MiB, top 10 allocations:', file=sys.stderr)
+            for stat in snapshot.statistics('lineno')[:10]:
+                real_print(stat, file=sys.stderr)
+
+
+def read_searches(path):
+    """the searches of a --batch file: one per line, blank lines and # comments are skipped, duplicates are run once"""
+    if path == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, 'r', encoding='utf8') as f:
+            lines = f.read().splitlines()
+    searches = [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+    return list(dict.fromkeys(searches))
+
+
+def main_batch(
+        searches,
+        category='',
+        limit=float('inf'),
+        domain='rarbgunblocked.org',
+        mirrors=(),
+        order='',
+        sort_order=None,
+        magnet=False,
+        sort=(),
+        torrent_filter=None,
+        no_cache=False,
+        no_cookie=False,
+        block_size='auto',
+        concurrency=4,
+        rate=None,
+        parser=DEFAULT_BACKEND,
+        cache_ttl=3600,
+):
+    """--batch: outputs the torrents of each search as ndjson (with a "query" key) as soon as the search is done"""
+    store = TorrentStore()
+    cookie_manager = CookieManager(COOKIES_PATH, log=print)
+    session = Session(cookie_manager.load(no_cookie), pool_maxsize=concurrency, rate_limit=rate, mirrors=[domain.strip(), *mirrors])
+    print(f'{len(searches)} searches')
+
+    failed = 0
+    results = iter_batch(
+        searches,
+        category,
+        order,
+        sort_order,
+        limit,
+        domain,
+        session=session,
+        cookie_manager=cookie_manager,
+        store=store,
+        cache_ttl=0 if no_cache else cache_ttl,
+        concurrency=concurrency,
+        parser=parser,
+        resolve=True,
+        torrent_filter=torrent_filter,
+        sort=sort,
+    )
+    for result in results:
+        if result.error is not None:
+            failed += 1
+            print(f'{result.search!r} failed: {result.error!r}')
+            continue
+        print(f'{result.search!r}: {len(result.records)} torrents found')
+        dicts = [record.to_dict(domain, block_size) for record in result.records]
+        for d in dicts:
+            real_print(d['magnet'] if magnet else json.dumps({'query': result.search, **d}), flush=True)
+
+    cookie_manager.flush()
+    session.close()
+    store.close()
+    return 1 if failed else 0
 
 
 def main(
@@ -176,54 +472,86 @@ def main(
         sort_order=None,
         interactive=False,
         magnet=False,
-        sort='',
+        sort=(),
+        torrent_filter=None,
         no_cache=False,
         no_cookie=False,
         block_size='auto',
-        _session_name='untitled',  # unique name based on args, used for caching
+        concurrency=4,
+        parser=DEFAULT_BACKEND,
+        offline=False,
+        cache_ttl=3600,
+        output_format='json',
+        rate=None,
+        mirrors=(),
+        archive_days=30,
+        torrent_dir=None,
+        magnet_command=None,
+        watch_dir=None,
 ):
-    cookies = load_cookies(no_cookie)
+    def render(records):
+        return [record.to_dict(domain, block_size) for record in records]
+
+    def resolve(records):
+        """fill in the info-hash of the records listed without one (and remember it in the store)"""
+        return resolve_torrents(records, session, domain, concurrency, store, log=print)
+
+    def open_torrents(dicts):
+        dispatch(dicts, session, torrent_dir, magnet_command, watch_dir, concurrency=concurrency, log=print)
 
     def print_results(dicts):
-        if sort:
-            dicts.sort(key=lambda x: x[sort], reverse=True)
         if limit < float('inf'):
             dicts = dicts[: int(limit)]
 
-        for d in dicts:
-            if not d['magnet']:
-                print('fetching magnet link for', d['title'])
-                try:
-                    html_subpage = requests.get(d['href'], cookies=cookies).text.encode('utf-8')
-                    parsed_html_subpage = BeautifulSoup(html_subpage, 'html.parser')
-                    d['magnet'] = parsed_html_subpage.select_one('a[href^="magnet:"]').get('href')
-                    d['torrent_file'] = parsed_html_subpage.select_one('a[href^="/download.php"]').get('href')
-                except Exception as e:
-                    print('Error:', e)
-
         # pretty print unique(dicts) as yaml
-        print('torrents:', yaml.dump(unique(dicts), default_flow_style=False))
+        import yaml
 
-        # reads file then merges with new dicts
-        with open(cache_file, 'w', encoding='utf8') as f:
-            json.dump(unique(dicts), f, indent=4)
+        print('torrents:', yaml.dump(unique(dicts), default_flow_style=False))
 
-        # open torrent urls in browser in the background (with delay between each one)
+        # hand the torrents over to the targets, or open the torrent urls in the browser (with delay between each one)
+        targets = ', '.join(target for target in [torrent_dir, magnet_command, watch_dir] if target) or 'browser'
         if download_torrents is True or interactive and input(
-                f'Open {len(dicts)} torrent files in browser for downloading? (Y/n) ').lower() != 'n':
-            torrent_urls = [d['torrent'] for d in dicts]
-            magnet_urls = [d['magnet'] for d in dicts]
-            asyncio.run(open_torrentfiles(torrent_urls + magnet_urls))
-
-        if magnet:
-            real_print('\n'.join([t['magnet'] for t in dicts]))
+                f'Send {len(dicts)} torrents to {targets} for downloading? (Y/n) ').lower() != 'n':
+            open_torrents(dicts)
+
+        with METRICS.stage('output'):
+            if magnet:
+                real_print('\n'.join([t['magnet'] for t in dicts]))
+            elif output_format == 'ndjson':
+                real_print('\n'.join([json.dumps(t) for t in dicts]))
+            else:
+                real_print(json.dumps(dicts, indent=4))
+
+    def stream_results(records):
+        """--format ndjson: output each torrent on its own line as soon as its page is parsed"""
+        dicts = render(records)
+        if download_torrents is True:
+            open_torrents(dicts)
+        with METRICS.stage('output'):
+            for d in dicts:
+                real_print(d['magnet'] if magnet else json.dumps(d), flush=True)
+        streamed.add(records)
+
+    def report_page(page):
+        """progress of the pagination, and the raw pages kept in the archive"""
+        if page.response is not None and archive is not None:
+            archive.add(page.response.url, page.response.text)
+        if page.status == 'error':
+            print('error', page.response.status_code)
+        elif page.status == 'cached':
+            print(f'{len(page.rows)} torrents found (page {page.number} is fresh in cache)')
         else:
-            real_print(json.dumps(dicts, indent=4))
-
-    def interactive_loop(dicts):
+            print(f'{len(page.rows)} torrents found')
+        if page.status == 'unchanged':
+            print(f'page {page.number} unchanged since last fetch')
+        if page.status == 'known_fresh':
+            print('all torrents of this page are already known and fresh, the rest is taken from the cache')
+
+    def interactive_loop(dicts, start_index=0, records=None):
+        """`records` are the TorrentRecords of the dicts, a selected one is resolved before it's printed"""
         while interactive:
             os.system('cls||clear')
-            user_input = get_user_input_interactive(dicts, start_index=len(dicts_all) - len(dicts_current))
+            user_input = get_user_input_interactive(dicts, start_index=start_index)
             print('user_input', user_input)
             if user_input is None:  # next page
                 print('\nNo item selected\n')
@@ -231,7 +559,10 @@ def main(
                 break
             else:  # indexes
                 input_index = int(user_input)
-                print_results([dicts[input_index]])
+                if records is None:
+                    print_results([dicts[input_index]])
+                else:
+                    print_results(render(resolve([records[input_index]])))
 
             try:
                 user_input = input('[ENTER]: back to results, [q or ctrl+C]: (q)uit')
@@ -245,96 +576,74 @@ def main(
                 continue
 
     # == dealing with cache and history ==
-    cache_file = os.path.join(PROGRAM_HOME, 'history', _session_name + '.json')
-    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
-    if os.path.exists(cache_file) and not no_cache:
-        try:
-            with open(cache_file, 'r') as f:
-                cache = json.load(f)
-        except Exception as e:
-            print('Error:', e)
-            os.remove(cache_file)
-            cache = []
-    else:
-        cache = []
-
-    dicts_all = []
-    i = 1
-    while True:  # for all pages
-        target_url = 'https://{domain}/torrents.php?search={search}&page={page}'
-        target_url_formatted = target_url.format(
-            domain=domain.strip(),
-            search=quote(search),
-            page=i,
+    store = TorrentStore()
+    session = cookie_manager = archive = None  # no network access --offline, except for downloading torrent files
+
+    # the interactive mode exits from within (q, Ctrl+C), the pending pages and counters are still written
+    try:
+        if offline:
+            dicts_all = dicts_current = search_offline(
+                search, category, sort, order, sort_order, limit, domain.strip(), block_size, torrent_filter=torrent_filter
+            )
+            print(f'{len(dicts_all)} torrents found offline')
+            if interactive:
+                interactive_loop(dicts_current)
+            else:
+                print_results(dicts_all)
+            return
+
+        cookie_manager = CookieManager(COOKIES_PATH, log=print)
+        session = Session(cookie_manager.load(no_cookie), pool_maxsize=concurrency, rate_limit=rate, mirrors=[domain.strip(), *mirrors])
+        # the raw pages are kept (compressed, deduplicated) for debugging and `rarbg bench`
+        archive = PageArchive(max_age_days=archive_days) if archive_days > 0 else None
+
+        scrape_args = dict(
+            search=search,
+            category=category,
+            order=order,
+            sort_order=sort_order,
+            limit=limit,
+            domain=domain,
+            session=session,
+            cookie_manager=cookie_manager,
+            store=store,
+            cache_ttl=0 if no_cache else cache_ttl,
+            concurrency=concurrency,
+            parser=parser,
+            torrent_filter=torrent_filter,
+            sort=sort,
+            on_page=report_page,
+            log=print,
         )
 
-        if sort_order:
-            target_url_formatted += '&by=' + sort_order.upper().strip()
-        if order:
-            target_url_formatted += '&order=' + order.strip()
-        if category:
-            target_url_formatted += '&category=' + ';'.join(CATEGORY2CODE[category])
-
-        r, html, cookies = get_page_html(target_url_formatted, cookies=cookies)
-
-        with open(os.path.join(os.path.dirname(cache_file), _session_name + f'_torrents_{i}.html'), 'w',
-                  encoding='utf8') as f:
-            f.write(r.text)
-        parsed_html = BeautifulSoup(html, 'html.parser')
-        torrents = parsed_html.select('tr.lista2 a[href^="/torrent/"][title]')
-
-        if r.status_code != 200:
-            print('error', r.status_code)
-            break
-
-        print(f'{len(torrents)} torrents found')
-        if len(torrents) == 0:
-            break
-        magnets = list(map(extract_magnet, torrents))
-        torrentfiles = list(map(partial(extract_torrent_file, domain=domain), torrents))
-
-        # removed torrents and magnet links that have empty magnets, but maintained order
-        torrents, magnets, torrentfiles = zip(*[[a, m, d] for (a, m, d) in zip(torrents, magnets, torrentfiles)])
-        torrents, magnets, torrentfiles = list(torrents), list(magnets), list(torrentfiles)
-
-        dicts_current = [
-            {
-                'title': torrent.get('title'),
-                'torrent': torrentfile,
-                'href': f"https://{domain}{torrent.get('href')}",
-                'date': datetime.datetime.strptime(
-                    str(torrent.findParent('tr').select_one('td:nth-child(3)').contents[0]), '%Y-%m-%d %H:%M:%S'
-                ).timestamp(),
-                'category': CODE2CATEGORY.get(
-                    torrent.findParent('tr').select_one('td:nth-child(1) img').get('src').split('/')[-1].replace(
-                        'cat_new', '').replace('.gif', ''),
-                    'UNKOWN',
-                ),
-                'size': format_size(parse_size(torrent.findParent('tr').select_one('td:nth-child(4)').contents[0]),
-                                    block_size),
-                'seeders': int(torrent.findParent('tr').select_one('td:nth-child(5) > font').contents[0]),
-                'leechers': int(torrent.findParent('tr').select_one('td:nth-child(6)').contents[0]),
-                'uploader': str(torrent.findParent('tr').select_one('td:nth-child(8)').contents[0]),
-                'magnet': magnet,
-            }
-            for (torrent, magnet, torrentfile) in zip(torrents, magnets, torrentfiles)
-        ]
-
-        dicts_all += dicts_current
-
-        cache = list(unique(dicts_all + cache))
-
         if interactive:
-            interactive_loop(dicts_current)
-
-        if len(list(filter(None, torrents))) >= limit:
-            print(f'reached limit {limit}, stopping')
-            break
-        i += 1
-
-    if not interactive:
-        dicts_all = list(unique(dicts_all + cache))
-        print_results(dicts_all)
+            shown = 0
+            # a page at a time, the torrents picked are resolved when printed
+            for _, records in iter_torrent_pages(**scrape_args):
+                records = rank(records, sort)
+                if records:
+                    interactive_loop(render(records), start_index=shown, records=records)
+                shown += len(records)
+        elif output_format == 'ndjson' and not sort:  # sorting needs all the results, so sorted ndjson is printed at the end like json
+            streamed = TorrentKeys()  # printed as they come, only their keys are kept
+            for _, records in iter_torrent_pages(**scrape_args, resolve=True):
+                stream_results(records)
+            # then what this query returned on previous runs
+            cached = stored_torrents(store, search, category, order, sort_order, scrape_args['cache_ttl'], torrent_filter)
+            cached = [record for record in cached if record not in streamed]
+            if limit < float('inf'):
+                cached = cached[: max(0, int(limit) - len(streamed))]
+            stream_results(resolve(cached))
+        else:
+            print_results(render(collect_torrents(**scrape_args, resolve=True)))
+    finally:
+        if cookie_manager is not None:
+            cookie_manager.flush()
+        if session is not None:
+            session.close()
+        store.close()
+        if archive is not None:
+            archive.close()
 
 
 if __name__ == '__main__':
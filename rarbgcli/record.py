@@ -0,0 +1,127 @@
+from typing import NamedTuple
+
+from rarbgcli import CODE2CATEGORY, format_size, magnet_url, torrent_file_url
+
+
+def hash_to_bytes(hash_):
+    """hex info-hash to its 20 raw bytes, b'' if missing or not a hex sha1"""
+    try:
+        return bytes.fromhex(hash_) if hash_ else b''
+    except ValueError:
+        return b''
+
+
+class TorrentRecord(NamedTuple):
+    """one torrent of a listing page, kept compact: a plain tuple with raw values.
+    The urls, the category name and the formatted size are only derived when rendering (see to_dict)"""
+
+    title: str
+    path: str  # torrent page path: "/torrent/..."
+    info_hash: bytes  # 20 bytes, b'' if the listing had no thumbnail to take it from
+    date: int  # unix timestamp
+    category_code: str
+    size: int  # bytes
+    seeders: int
+    leechers: int
+    uploader: str
+
+    @property
+    def hash(self):
+        return self.info_hash.hex()
+
+    @property
+    def category(self):
+        return CODE2CATEGORY.get(self.category_code, 'UNKOWN')
+
+    @property
+    def magnet(self):
+        return magnet_url(self.hash, self.title) if self.info_hash else ''
+
+    def url(self, domain='rarbgunblocked.org'):
+        return f'https://{domain}{self.path}'
+
+    def torrent_url(self, domain='rarbgunblocked.org'):
+        return torrent_file_url(self.path, self.title, domain)
+
+    def key(self):
+        """identifies the torrent: its info-hash, or its page path if the hash is unknown"""
+        return self.info_hash or self.path
+
+    def to_dict(self, domain='rarbgunblocked.org', block_size=None):
+        """the torrent dict as output by the CLI"""
+        return {
+            'title': self.title,
+            'torrent': self.torrent_url(domain),
+            'href': self.url(domain),
+            'date': float(self.date),
+            'category': self.category,
+            'size': format_size(self.size, block_size),
+            'seeders': self.seeders,
+            'leechers': self.leechers,
+            'uploader': self.uploader,
+            'magnet': self.magnet,
+        }
+
+
+class TorrentIndex:
+    """ordered collection of TorrentRecords deduplicated by info-hash, falling back to the page path.
+    Adding a torrent that's already in the index replaces it where it is (last write wins for the
+    volatile fields like seeders/leechers), a known info-hash is never lost. Each add is O(1)."""
+
+    def __init__(self, records=()):
+        self._records = {}  # key -> record, in first seen order
+        self._aliases = {}  # info-hash and path -> key
+        self.add(records)
+
+    def _key(self, record):
+        return self._aliases.get(record.info_hash) or self._aliases.get(record.path) or record.info_hash or record.path
+
+    def add(self, records, overwrite=True):
+        """add (or merge) records, with overwrite=False the ones already in the index are kept as they are"""
+        for record in records:
+            key = self._key(record)
+            old = self._records.get(key)
+            if old is not None:
+                if not overwrite:
+                    continue
+                if not record.info_hash and old.info_hash:
+                    record = record._replace(info_hash=old.info_hash)
+            self._records[key] = record
+            if record.info_hash:
+                self._aliases[record.info_hash] = key
+            self._aliases[record.path] = key
+        return self
+
+    def __contains__(self, record):
+        return self._key(record) in self._records
+
+    def __iter__(self):
+        return iter(self._records.values())
+
+    def __len__(self):
+        return len(self._records)
+
+
+class TorrentKeys:
+    """the info-hashes and page paths of the torrents seen so far: the `in` of a TorrentIndex, without keeping the records
+    (for streaming, where the records are output as they come)"""
+
+    def __init__(self, records=()):
+        self._keys = set()  # info-hashes (bytes) and paths (str), they can't collide
+        self._count = 0
+        self.add(records)
+
+    def add(self, records):
+        for record in records:
+            if record not in self:
+                self._count += 1
+            if record.info_hash:
+                self._keys.add(record.info_hash)
+            self._keys.add(record.path)
+        return self
+
+    def __contains__(self, record):
+        return (bool(record.info_hash) and record.info_hash in self._keys) or record.path in self._keys
+
+    def __len__(self):
+        return self._count
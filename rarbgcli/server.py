@@ -0,0 +1,245 @@
+"""
+rarbg serve - local HTTP/JSON server over the scraper, keeps the session, cookies and torrent store warm between queries.
+
+    $ rarbg serve --port 8080
+    $ curl 'http://127.0.0.1:8080/search?q=the+stranger+things+3&category=tvshows&limit=10'
+
+GET /search   q (required), category, order, sort_order, sort, limit: the same torrent JSON `rarbg` prints.
+              sort takes the keys of `rarbg --sort`, comma separated or repeated: sort=seeders,%2Bsize
+GET /stats    request counters, cookie stats, per host stats and page cache hits/misses
+
+Identical queries arriving while one is being scraped wait for that scrape instead of starting their own,
+pages fetched less than --cache_ttl seconds ago are answered from the store.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from rarbgcli import CATEGORY2CODE, COOKIES_PATH, pprint, size_units
+from rarbgcli.api import LockedStore, collect_torrents
+from rarbgcli.cache import PAGE_CACHE
+from rarbgcli.cookies import CookieManager
+from rarbgcli.filters import parse_sort_key
+from rarbgcli.parser import BACKENDS, DEFAULT_BACKEND
+from rarbgcli.session import Session
+from rarbgcli.store import ORDER_COLUMNS, TorrentStore, query_key
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def parse_search_params(query_string):
+    """the search arguments of a /search query string, raises BadRequest for invalid ones"""
+    multi_params = parse_qs(query_string)
+    params = {key: values[-1] for key, values in multi_params.items()}
+    search = params.get('q', '').strip()
+    if not search:
+        raise BadRequest('missing q')
+    args = {
+        'search': search,
+        'category': params.get('category', 'nonxxx'),
+        'order': params.get('order', ''),
+        'sort_order': params.get('sort_order') or None,
+        # a tuple, the arguments also key the in-flight queries
+        'sort': tuple(key.strip() for keys in multi_params.get('sort', []) for key in keys.split(',') if key.strip()),
+    }
+    choices = {'category': CATEGORY2CODE, 'order': ORDER_COLUMNS, 'sort_order': ['asc', 'desc', None]}
+    for name, allowed in choices.items():
+        if args[name] and args[name] not in allowed:
+            raise BadRequest(f'invalid {name} {args[name]!r}, choices are: {[choice for choice in allowed if choice]}')
+    try:
+        for key in args['sort']:
+            parse_sort_key(key)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    try:
+        args['limit'] = float(params.get('limit', 'inf'))
+    except ValueError:
+        raise BadRequest(f"invalid limit {params['limit']!r}")
+    if math.isnan(args['limit']) or args['limit'] < 1:
+        raise BadRequest('limit must be a number, at least 1')
+    return args
+
+
+class SearchServer:
+    def __init__(
+        self,
+        domain='rarbgunblocked.org',
+        mirrors=(),
+        concurrency=4,
+        workers=4,
+        rate=None,
+        cache_ttl=3600,
+        parser=DEFAULT_BACKEND,
+        block_size=None,
+        log=pprint,
+    ):
+        self.domain = domain.strip()
+        self.concurrency = concurrency
+        self.cache_ttl = cache_ttl
+        self.parser = parser
+        self.block_size = block_size
+        self.log = log
+        self.cookie_manager = CookieManager(COOKIES_PATH, log=log)
+        self.session = Session(self.cookie_manager.load(), pool_maxsize=concurrency * workers, rate_limit=rate, mirrors=[self.domain, *mirrors])
+        self.store = LockedStore(TorrentStore())
+        # the blocking scrapes run here, `workers` different queries at a time
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.in_flight = {}  # query -> future of its result, shared by identical concurrent queries
+        self.counters = {'requests': 0, 'scrapes': 0, 'coalesced': 0, 'errors': 0}
+
+    def _search(self, search, category, order, sort_order, sort, limit):
+        records = collect_torrents(
+            search,
+            category,
+            order,
+            sort_order,
+            limit,
+            self.domain,
+            session=self.session,
+            cookie_manager=self.cookie_manager,
+            store=self.store,
+            cache_ttl=self.cache_ttl,
+            concurrency=self.concurrency,
+            parser=self.parser,
+            resolve=True,
+            sort=sort,
+        )
+        self.cookie_manager.flush()
+        return [record.to_dict(self.domain, self.block_size) for record in records]
+
+    async def search(self, search, category='', order='', sort_order=None, sort=(), limit=float('inf')):
+        key = (query_key(search, category, order, sort_order), sort, limit)
+        future = self.in_flight.get(key)
+        if future is None:
+            self.counters['scrapes'] += 1
+            future = asyncio.get_event_loop().run_in_executor(self.executor, self._search, search, category, order, sort_order, sort, limit)
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.counters['coalesced'] += 1
+        # shielded: a client hanging up doesn't cancel the scrape the others are waiting for
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {
+            **self.counters,
+            'in_flight': len(self.in_flight),
+            'cookies': {'age': self.cookie_manager.age, 'success_rate': self.cookie_manager.success_rate},
+            'hosts': self.session.scheduler.stats(),
+            'page_cache': PAGE_CACHE.stats(),
+        }
+
+    async def route(self, method, target):
+        """(status, payload) of a request"""
+        url = urlsplit(target)
+        if method != 'GET':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'only GET is supported'}
+        if url.path == '/search':
+            try:
+                args = parse_search_params(url.query)
+            except BadRequest as e:
+                return HTTPStatus.BAD_REQUEST, {'error': str(e)}
+            self.log('search', args)
+            try:
+                return HTTPStatus.OK, await self.search(**args)
+            except Exception as e:
+                self.counters['errors'] += 1
+                self.log('search failed:', repr(e))
+                return HTTPStatus.BAD_GATEWAY, {'error': f'{type(e).__name__}: {e}'}
+        if url.path == '/stats':
+            return HTTPStatus.OK, self.stats()
+        return HTTPStatus.NOT_FOUND, {'error': f'unknown path {url.path}, use /search or /stats'}
+
+    async def handle(self, reader, writer):
+        """one request per connection"""
+        self.counters['requests'] += 1
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()).strip():  # skip the headers, GET requests have no body
+                pass
+            if len(request_line) != 3:
+                status, payload = HTTPStatus.BAD_REQUEST, {'error': 'malformed request'}
+            else:
+                status, payload = await self.route(request_line[0], request_line[1])
+            body = json.dumps(payload, indent=4).encode('utf8')
+            head = (
+                f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+            )
+            writer.write(head.encode('latin-1') + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        server = await asyncio.start_server(self.handle, host, port)
+        self.log(f'serving on http://{host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.cookie_manager.flush()
+        self.session.close()
+        self.store.close()
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser('rarbg serve', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--domain', default='rarbgunblocked.org', help='Domain to search')
+    parser.add_argument('--mirrors', nargs='+', metavar='DOMAIN', default=[], help='Other mirrors of --domain to fail over to')
+    parser.add_argument('--concurrency', '-j', type=int, default=4, help='Number of result pages of a query to fetch in parallel')
+    parser.add_argument('--workers', type=int, default=4, help='Number of different queries scraped at the same time')
+    parser.add_argument('--rate', type=float, default=None, metavar='N', help='Send at most N requests per second to each host')
+    parser.add_argument(
+        '--cache_ttl',
+        type=float,
+        default=3600,
+        metavar='SECONDS',
+        help='Pages fetched less than SECONDS ago are answered from the store',
+    )
+    parser.add_argument('--parser', choices=BACKENDS, default=DEFAULT_BACKEND, help='HTML parser backend for the result pages')
+    parser.add_argument(
+        '--block_size',
+        '-B',
+        type=lambda x: x.upper(),
+        metavar='SIZE',
+        default=None,
+        choices=list(size_units.keys()),
+        help='Display torrent sizes in SIZE unit',
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = get_args(argv)
+    if args.concurrency < 1 or args.workers < 1:
+        print('--concurrency and --workers must be at least 1', file=sys.stderr)
+        return 1
+    if args.rate is not None and not args.rate > 0:  # also NaN
+        print('--rate must be greater than 0', file=sys.stderr)
+        return 1
+    server = SearchServer(args.domain, args.mirrors, args.concurrency, args.workers, args.rate, args.cache_ttl, args.parser, args.block_size)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,86 @@
+import time
+
+from rarbgcli.hosts import FAILOVER_STATUSES, HostScheduler
+from rarbgcli.metrics import METRICS
+
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.122 Safari/537.36'
+
+
+class Session:
+    """a single keep-alive connection pool shared by every request of a run.
+    Carries the captcha cookies, headers, timeout and retry-with-backoff policy,
+    the requests are accounted for in rarbgcli.metrics.METRICS.
+    Requests go through a rarbgcli.hosts.HostScheduler: at most `rate_limit` requests per second per host
+    (adapted down when a host throttles), and requests to one of the `mirrors` are routed to the healthiest one"""
+
+    def __init__(self, cookies=None, headers=None, timeout=30, retries=3, backoff_factor=0.5, pool_maxsize=10, rate_limit=None, mirrors=()):
+        # imported here, runs served from the cache never load requests
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        # the same dict is kept (and updated in place by get_page_html) so that all users see fresh cookies
+        self.cookies = cookies if cookies is not None else {}
+        self.timeout = timeout
+        self.scheduler = HostScheduler(mirrors, rate=rate_limit)
+        self._network_errors = (requests.ConnectionError, requests.Timeout)
+
+        self._session = requests.Session()
+        self._session.headers.update({'User-Agent': USER_AGENT})
+        self._session.headers.update(headers or {})
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=FAILOVER_STATUSES,
+            # with mirrors to fail over to, an error status is handed back at once and the next mirror is tried
+            status=0 if len(mirrors) > 1 else None,
+            raise_on_status=False,  # hand back the last response, callers check status_code
+        )
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('cookies', dict(self.cookies))
+        tried = set()
+        while True:
+            host = self.scheduler.pick(url, exclude=tried)
+            tried.add(host)
+            target = self.scheduler.route(url, host)
+            with METRICS.stage('rate_limit_wait'):
+                self.scheduler.acquire(host)
+            start = time.perf_counter()
+            try:
+                r = self._session.request(method, target, **kwargs)
+            except self._network_errors as e:
+                self.scheduler.report(host, time.perf_counter() - start, error=e)
+                METRICS.count('network_errors')
+                if self.scheduler.has_alternative(url, tried):
+                    METRICS.count('failovers')
+                    continue
+                raise
+            self.scheduler.report(host, time.perf_counter() - start, r.status_code, retry_after=r.headers.get('Retry-After'))
+            METRICS.count('requests')
+            METRICS.count('bytes_downloaded', len(r.content))
+            # the retries urllib3 made before handing back this response
+            METRICS.count('retries', len(getattr(getattr(getattr(r, 'raw', None), 'retries', None), 'history', ())))
+            if r.status_code in FAILOVER_STATUSES and self.scheduler.has_alternative(url, tried):
+                METRICS.count('failovers')
+                continue
+            return r
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def close(self):
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,326 @@
+"""
+rarbg solver - keeps a headless Chrome and tesseract warm to solve the threat defence CAPTCHA.
+
+Starting Chrome is most of the time of a CAPTCHA solve. While the solver daemon runs,
+rarbgcli processes send it their CAPTCHAs instead of starting a browser of their own:
+
+    $ rarbg solver &                  # start the daemon (listens on localhost only)
+    $ rarbg solver --solve URL        # solve one CAPTCHA page and print the cookies (uses the daemon if it runs)
+    $ rarbg solver --stop
+
+The address and key of the running daemon are in ~/.rarbgcli/solver.json.
+Without a daemon, CAPTCHAs are solved in the rarbgcli process itself, as before.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+
+from rarbgcli import PROGRAM_HOME, pprint
+
+SOLVER_PATH = os.path.join(PROGRAM_HOME, 'solver.json')
+
+
+# Captcha solving taken from https://github.com/confident-hate/seedr-cli
+class CaptchaSolver:
+    """a headless Chrome that's started on the first solve and kept for the next ones (until close()).
+    Every step waits for the page to be ready instead of sleeping a fixed time"""
+
+    def __init__(self, timeout=20, log=pprint):
+        self.timeout = timeout
+        self.log = log
+        self.driver = None
+        self.last_used = time.time()
+        self._lock = threading.Lock()
+        self._tesseract_checked = False
+
+    def _start(self):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+        from webdriver_manager.chrome import ChromeDriverManager
+
+        options = Options()
+        options.add_argument('--no-sandbox')
+        options.add_argument('--headless')
+        options.add_argument('--log-level=3')
+        options.add_argument('--disable-logging')
+        options.add_argument('--output=' + ('NUL' if sys.platform == 'win32' else '/dev/null'))
+
+        self.driver = webdriver.Chrome(
+            ChromeDriverManager(path=PROGRAM_HOME).install(),
+            chrome_options=options,
+            service_log_path=('NUL' if sys.platform == 'win32' else '/dev/null'),
+        )
+        self.driver.implicitly_wait(0)  # the waits are explicit
+        self.log('successfully loaded chrome driver')
+
+    def _check_tesseract(self):
+        import pytesseract
+
+        if sys.platform == 'win32':
+            pytesseract.pytesseract.tesseract_cmd = os.path.join(PROGRAM_HOME, 'Tesseract-OCR', 'tesseract')
+        try:
+            pytesseract.get_tesseract_version()
+        except pytesseract.TesseractNotFoundError:
+            from rarbgcli.utils import download_tesseract
+
+            self.log('Tesseract not found. Downloading tesseract ...')
+            cwd = os.getcwd()
+            try:
+                download_tesseract.main(PROGRAM_HOME)
+            finally:
+                os.chdir(cwd)
+        self._tesseract_checked = True
+
+    def ocr(self, png):
+        from io import BytesIO
+
+        import pytesseract
+        from PIL import Image
+
+        return pytesseract.image_to_string(Image.open(BytesIO(png))).strip()
+
+    def _attempt(self, threat_defence_url):
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.common.keys import Keys
+        from selenium.webdriver.support import expected_conditions as ec
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        driver = self.driver
+        wait = WebDriverWait(driver, self.timeout, poll_frequency=0.2)
+        driver.get(threat_defence_url)
+
+        # the captcha form may be behind a "Click here" link
+        wait.until(lambda d: d.find_elements_by_link_text('Click here') or d.find_elements_by_id('solve_string'))
+        for link in driver.find_elements_by_link_text('Click here'):
+            link.click()
+            break
+        text_field = wait.until(ec.element_to_be_clickable((By.ID, 'solve_string')))
+
+        def captcha_image(d):
+            images = d.find_elements_by_css_selector('img')
+            if len(images) > 1 and d.execute_script('return arguments[0].complete && arguments[0].naturalWidth > 0', images[1]):
+                return images[1]
+            return False
+
+        solution = self.ocr(wait.until(captcha_image).screenshot_as_png)
+        text_field.send_keys(solution)
+        text_field.send_keys(Keys.RETURN)
+        try:
+            wait.until(lambda d: 'threat_defence' not in d.current_url)
+        except TimeoutException:
+            return None
+
+        cookies = {c['name']: c['value'] for c in driver.get_cookies()}
+        driver.delete_all_cookies()  # the next solve starts from a clean browser
+        return cookies
+
+    def solve(self, threat_defence_url, attempts=3):
+        """returns the cookies once the CAPTCHA at threat_defence_url is solved, a misread CAPTCHA is tried again with a new one"""
+        from selenium.common.exceptions import WebDriverException
+
+        with self._lock:
+            self.last_used = time.time()
+            if not self._tesseract_checked:
+                self._check_tesseract()
+            try:
+                for attempt in range(1, attempts + 1):
+                    if self.driver is None:
+                        self._start()
+                    try:
+                        cookies = self._attempt(threat_defence_url)
+                    except WebDriverException as e:  # e.g. the browser crashed, it's restarted for the next attempt
+                        self.log(f'captcha attempt {attempt}/{attempts} failed:', e)
+                        self._quit()
+                        continue
+                    if cookies is not None:
+                        return cookies
+                    self.log(f'captcha attempt {attempt}/{attempts} was not accepted')
+                raise RuntimeError(f'captcha not solved after {attempts} attempts')
+            finally:
+                self.last_used = time.time()
+
+    def _quit(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+            self.driver = None
+
+    def close(self):
+        with self._lock:
+            self._quit()
+
+    def close_if_idle(self, idle_timeout):
+        """quit the browser if it wasn't used for idle_timeout seconds, it's started again on the next solve"""
+        with self._lock:
+            if self.driver is not None and time.time() - self.last_used > idle_timeout:
+                self.log(f'browser idle for {idle_timeout}s, closing it')
+                self._quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _TimeoutConnection:
+    """a Connection whose reads give up after `timeout` seconds, so a client that connects and never sends
+    can't hold the daemon (which serves one connection at a time)"""
+
+    def __init__(self, conn, timeout):
+        self.conn = conn
+        self.timeout = timeout
+
+    def _wait(self):
+        if not self.conn.poll(self.timeout):
+            raise TimeoutError(f'nothing received from the client in {self.timeout}s')
+
+    def send_bytes(self, data):
+        self.conn.send_bytes(data)
+
+    def recv_bytes(self, maxlength=None):
+        self._wait()
+        return self.conn.recv_bytes(maxlength)
+
+    def send(self, obj):
+        self.conn.send(obj)
+
+    def recv(self):
+        self._wait()
+        return self.conn.recv()
+
+
+def _handle(conn, solver, log):
+    message = conn.recv()
+    if message[0] == 'solve':
+        _, url, attempts = message
+        log('solving', url)
+        try:
+            conn.send(('ok', solver.solve(url, attempts)))
+        except Exception as e:
+            conn.send(('error', f'{type(e).__name__}: {e}'))
+    elif message[0] == 'ping':
+        conn.send(('ok', os.getpid()))
+    elif message[0] == 'stop':
+        conn.send(('ok', None))
+        return False
+    else:
+        conn.send(('error', f'unknown command {message[0]!r}'))
+    return True
+
+
+def serve(port=0, idle_timeout=600, path=SOLVER_PATH, log=pprint, client_timeout=10, solver=None):
+    """run the solver daemon on localhost, CAPTCHAs are solved one at a time with the same browser.
+    A client has `client_timeout` seconds to authenticate and send its request"""
+    authkey = os.urandom(16)
+    solver = solver if solver is not None else CaptchaSolver(log=log)
+    stopped = threading.Event()
+
+    def close_idle_browser():
+        while not stopped.wait(min(60, idle_timeout)):
+            solver.close_if_idle(idle_timeout)
+
+    # the listener doesn't authenticate by itself: its handshake would wait for the client without a timeout
+    with Listener(('127.0.0.1', port)) as listener:
+        # only the owner can read the key
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump({'port': listener.address[1], 'authkey': authkey.hex(), 'pid': os.getpid()}, f)
+        log(f'captcha solver listening on 127.0.0.1:{listener.address[1]}')
+        threading.Thread(target=close_idle_browser, daemon=True).start()
+        try:
+            running = True
+            while running:
+                try:
+                    raw_conn = listener.accept()
+                except OSError as e:
+                    log('could not accept connection:', e)
+                    continue
+                with raw_conn:
+                    conn = _TimeoutConnection(raw_conn, client_timeout)
+                    try:
+                        deliver_challenge(conn, authkey)
+                        answer_challenge(conn, authkey)
+                    except (AuthenticationError, OSError, EOFError) as e:  # wrong key, silent or gone client
+                        log('rejected connection:', e)
+                        continue
+                    try:
+                        running = _handle(conn, solver, log)
+                    except (OSError, EOFError) as e:  # the client went away, or never sent its request
+                        log('connection lost:', e)
+        finally:
+            stopped.set()
+            solver.close()
+            with open(path) as f:
+                if json.load(f).get('pid') == os.getpid():
+                    os.remove(path)
+
+
+def _request(message, timeout, path=SOLVER_PATH):
+    """send a message to the running daemon.
+    Raises FileNotFoundError or ConnectionError if there's none, TimeoutError if it doesn't answer in time,
+    RuntimeError if it failed"""
+    with open(path) as f:
+        info = json.load(f)
+    with Client(('127.0.0.1', info['port']), authkey=bytes.fromhex(info['authkey'])) as conn:
+        conn.send(message)
+        if not conn.poll(timeout):
+            raise TimeoutError(f'no answer from the captcha solver in {timeout}s')
+        status, result = conn.recv()
+    if status != 'ok':
+        raise RuntimeError(result)
+    return result
+
+
+def solve_remote(threat_defence_url, attempts=3, timeout=300, path=SOLVER_PATH):
+    """solve with the solver daemon, raises FileNotFoundError or ConnectionError if it doesn't run (see _request)"""
+    return _request(('solve', threat_defence_url, attempts), timeout, path)
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser('rarbg solver', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=0, help='Port to listen on (localhost only), a free one by default')
+    parser.add_argument('--idle_timeout', type=float, default=600, help='Close the browser after this many seconds without a CAPTCHA')
+    parser.add_argument('--solve', metavar='URL', help="Solve the CAPTCHA page at URL and print the cookies, then exit")
+    parser.add_argument('--attempts', type=int, default=3, help='CAPTCHAs to try before giving up (with --solve)')
+    parser.add_argument('--stop', action='store_true', help='Stop the running daemon')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = get_args(argv)
+    if args.stop:
+        try:
+            _request(('stop',), timeout=10)
+        except OSError as e:
+            print('no captcha solver running:', e, file=sys.stderr)
+            return 1
+        return 0
+
+    if args.solve:
+        try:
+            cookies = solve_remote(args.solve, args.attempts)
+        except (FileNotFoundError, ConnectionError):  # no daemon running
+            with CaptchaSolver() as solver:
+                cookies = solver.solve(args.solve, args.attempts)
+        print(json.dumps(cookies))
+        return 0
+
+    try:
+        serve(args.port, args.idle_timeout)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
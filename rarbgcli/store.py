@@ -0,0 +1,301 @@
+"""
+persistent torrent store: a single SQLite database replacing the per-query JSON history files.
+Also answers --offline searches through a full-text index on the titles.
+
+Torrents are stored once, as the raw values of rarbgcli.record.TorrentRecord, keyed by info-hash
+(or by the torrent page path while the hash isn't known yet) and are upserted, never rewritten in full.
+The `queries` table remembers which torrents every query returned, and in which order,
+the query key ignores output-only options (--limit, --sort, ...) so those share the same rows.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+from rarbgcli import CATEGORY2CODE, PROGRAM_HOME
+from rarbgcli.filters import rank
+from rarbgcli.record import TorrentRecord, hash_to_bytes
+
+STORE_PATH = os.path.join(PROGRAM_HOME, 'torrents.db')
+
+# columns of the torrents table holding the TorrentRecord fields
+ROW_FIELDS = ['title', 'href', 'hash', 'date', 'category_code', 'size', 'seeders', 'leechers', 'uploader']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS torrents (
+    key TEXT PRIMARY KEY,  -- info-hash, or the torrent page path if the hash is unknown
+    title TEXT NOT NULL,
+    href TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    date REAL,
+    category_code TEXT,
+    size INTEGER,
+    seeders INTEGER,
+    leechers INTEGER,
+    uploader TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS torrents_title ON torrents (title);
+CREATE INDEX IF NOT EXISTS torrents_category ON torrents (category_code);
+CREATE INDEX IF NOT EXISTS torrents_date ON torrents (date);
+CREATE INDEX IF NOT EXISTS torrents_seeders ON torrents (seeders);
+CREATE INDEX IF NOT EXISTS torrents_size ON torrents (size);
+CREATE INDEX IF NOT EXISTS torrents_href ON torrents (href);
+
+CREATE TABLE IF NOT EXISTS queries (
+    query TEXT NOT NULL,
+    key TEXT NOT NULL REFERENCES torrents (key) ON UPDATE CASCADE ON DELETE CASCADE,
+    page INTEGER,
+    position INTEGER,
+    PRIMARY KEY (query, key)
+);
+
+-- freshness of every fetched result page, so only stale pages are fetched again
+CREATE TABLE IF NOT EXISTS pages (
+    query TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    url TEXT,
+    fetched REAL,
+    content_hash TEXT,
+    row_count INTEGER,
+    PRIMARY KEY (query, page)
+);
+"""
+
+# full-text index on the titles for offline searches, kept in sync with the torrents table by triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE torrents_fts USING fts5 (title, content = 'torrents', content_rowid = 'rowid');
+CREATE TRIGGER torrents_fts_insert AFTER INSERT ON torrents BEGIN
+    INSERT INTO torrents_fts (rowid, title) VALUES (new.rowid, new.title);
+END;
+CREATE TRIGGER torrents_fts_delete AFTER DELETE ON torrents BEGIN
+    INSERT INTO torrents_fts (torrents_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+END;
+CREATE TRIGGER torrents_fts_update AFTER UPDATE OF title ON torrents BEGIN
+    INSERT INTO torrents_fts (torrents_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+    INSERT INTO torrents_fts (rowid, title) VALUES (new.rowid, new.title);
+END;
+INSERT INTO torrents_fts (torrents_fts) VALUES ('rebuild');
+"""
+
+# --sort keys and --order keys to columns
+SORT_COLUMNS = {'title': 'title', 'date': 'date', 'size': 'size', 'seeders': 'seeders', 'leechers': 'leechers'}
+ORDER_COLUMNS = {'data': 'date', 'filename': 'title', 'leechers': 'leechers', 'seeders': 'seeders', 'size': 'size'}
+
+
+def row_key(record):
+    return record.hash or record.path
+
+
+def to_columns(record):
+    return (record.title, record.path, record.hash, record.date, record.category_code, record.size, record.seeders, record.leechers, record.uploader)
+
+
+def from_columns(row):
+    return TorrentRecord(
+        title=row['title'],
+        path=row['href'],
+        info_hash=hash_to_bytes(row['hash']),
+        date=int(row['date']),
+        category_code=row['category_code'],
+        size=row['size'],
+        seeders=row['seeders'],
+        leechers=row['leechers'],
+        uploader=row['uploader'],
+    )
+
+
+def query_key(search, category='', order='', sort_order=None):
+    """identifies the rows a query returns, only the arguments that change what the site returns are used"""
+    return json.dumps([search.strip().lower(), category or '', order or '', (sort_order or '').lower()])
+
+
+class TorrentStore:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # may be used from another thread than the one that opened it (e.g. aiter_torrents), but never concurrently
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.executescript(SCHEMA)
+        self.fts = self._ensure_fts()
+
+    def _ensure_fts(self):
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'torrents_fts'").fetchone():
+            return True
+        try:
+            self.conn.executescript(FTS_SCHEMA)
+            return True
+        except sqlite3.OperationalError:  # sqlite built without fts5, searches fall back to LIKE
+            return False
+
+    def upsert(self, rows, query=None, page=None, overwrite=True, updated=None):
+        """insert the rows, or update the volatile fields (seeders, leechers, ...) of the ones already stored.
+        If `query` is given the rows are also recorded as results of that query, in order.
+        With overwrite=False the rows already stored are left as they are (e.g. when importing older data).
+        `updated` is when the rows were scraped, now by default"""
+        now = time.time() if updated is None else updated
+        rows = self.fill_known_hashes(rows)
+        if overwrite:
+            on_conflict = f"DO UPDATE SET {', '.join(f'{field} = excluded.{field}' for field in ROW_FIELDS)}, updated = excluded.updated"
+        else:
+            on_conflict = 'DO NOTHING'
+        with self.conn:
+            self.conn.executemany(
+                f"""
+                INSERT INTO torrents (key, {', '.join(ROW_FIELDS)}, updated) VALUES (?, {', '.join('?' * len(ROW_FIELDS))}, ?)
+                ON CONFLICT (key) {on_conflict}
+                """,
+                [(row_key(row), *to_columns(row), now) for row in rows],
+            )
+            if query is not None:
+                self.conn.executemany(
+                    """
+                    INSERT INTO queries (query, key, page, position) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (query, key) DO UPDATE SET page = excluded.page, position = excluded.position
+                    """,
+                    [(query, row_key(row), page, position) for position, row in enumerate(rows)],
+                )
+
+    def fill_known_hashes(self, rows):
+        """returns the rows, with the hash resolved on a previous run filled in for the ones that have none"""
+        hashless = {row.path for row in rows if not row.info_hash}
+        if not hashless:
+            return rows
+        cursor = self.conn.execute(f"SELECT href, hash FROM torrents WHERE hash != '' AND href IN ({', '.join('?' * len(hashless))})", list(hashless))
+        known = {href: hash_to_bytes(hash_) for href, hash_ in cursor}
+        return [row._replace(info_hash=known[row.path]) if not row.info_hash and row.path in known else row for row in rows]
+
+    def query_rows(self, query):
+        """rows previously returned by `query`, in the order the site returned them"""
+        cursor = self.conn.execute(
+            f"""
+            SELECT {', '.join('t.' + field for field in ROW_FIELDS)} FROM queries q JOIN torrents t ON q.key = t.key
+            WHERE q.query = ? ORDER BY q.page, q.position
+            """,
+            (query,),
+        )
+        return [from_columns(row) for row in cursor]
+
+    def page_rows(self, query):
+        """{page: rows} of the rows previously returned by `query`"""
+        pages = {}
+        cursor = self.conn.execute(
+            f"""
+            SELECT q.page, {', '.join('t.' + field for field in ROW_FIELDS)} FROM queries q JOIN torrents t ON q.key = t.key
+            WHERE q.query = ? ORDER BY q.page, q.position
+            """,
+            (query,),
+        )
+        for row in cursor:
+            pages.setdefault(row['page'], []).append(from_columns(row))
+        return pages
+
+    def page_meta(self, query):
+        """{page: {'url', 'fetched', 'content_hash', 'row_count'}} of the pages fetched for `query`"""
+        cursor = self.conn.execute('SELECT page, url, fetched, content_hash, row_count FROM pages WHERE query = ?', (query,))
+        return {row['page']: dict(row) for row in cursor}
+
+    def set_page_meta(self, query, page, url, content_hash, row_count, fetched=None):
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO pages (query, page, url, fetched, content_hash, row_count) VALUES (?, ?, ?, ?, ?, ?)',
+                (query, page, url, time.time() if fetched is None else fetched, content_hash, row_count),
+            )
+
+    def count_fresh(self, rows, since, query=None):
+        """how many of `rows` are already stored and were seen after `since` (a timestamp).
+        With a `query`, only the rows previously returned by that query count"""
+        keys = [row_key(row) for row in rows]
+        if not keys:
+            return 0
+        sql = f"SELECT COUNT(*) FROM torrents t WHERE t.updated >= ? AND t.key IN ({', '.join('?' * len(keys))})"
+        params = [since, *keys]
+        if query is not None:
+            sql += ' AND t.key IN (SELECT key FROM queries WHERE query = ?)'
+            params.append(query)
+        return self.conn.execute(sql, params).fetchone()[0]
+
+    def search(self, search='', category='', sort='', order='', sort_order=None, limit=None):
+        """offline search over every stored torrent, all the words of `search` must appear in the title.
+        `sort` sorts descending by that key, otherwise `order`/`sort_order` behave like the site's ordering"""
+        words = re.findall(r'\w+', search.lower())
+        where, params = [], []
+        if words and self.fts:
+            where.append('t.rowid IN (SELECT rowid FROM torrents_fts WHERE torrents_fts MATCH ?)')
+            params.append(' '.join('"' + word + '"' for word in words))
+        else:
+            for word in words:
+                where.append('t.title LIKE ?')
+                params.append(f'%{word}%')
+        codes = CATEGORY2CODE.get(category) or []
+        if codes:
+            where.append(f"t.category_code IN ({', '.join('?' * len(codes))})")
+            params += codes
+
+        sql = f"SELECT {', '.join('t.' + field for field in ROW_FIELDS)} FROM torrents t"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        if sort:
+            sql += f' ORDER BY t.{SORT_COLUMNS[sort]} DESC'
+        elif order:
+            sql += f" ORDER BY t.{ORDER_COLUMNS[order]} {'ASC' if (sort_order or '').lower() == 'asc' else 'DESC'}"
+        if limit is not None and limit < float('inf'):
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        return [from_columns(row) for row in self.conn.execute(sql, params)]
+
+    def set_hash(self, href, hash_):
+        """record the info-hash of a torrent that was stored without one (it had no thumbnail)"""
+        with self.conn:
+            if self.conn.execute('SELECT 1 FROM torrents WHERE key = ?', (hash_,)).fetchone():
+                # already known under its hash, move the queries over and drop the path keyed duplicate
+                self.conn.execute('UPDATE OR IGNORE queries SET key = ? WHERE key = ?', (hash_, href))
+                self.conn.execute('DELETE FROM torrents WHERE key = ?', (href,))
+            else:
+                self.conn.execute('UPDATE torrents SET key = ?, hash = ? WHERE key = ?', (hash_, hash_, href))
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def search_offline(
+    search='',
+    category='',
+    sort=(),
+    order='',
+    sort_order=None,
+    limit=float('inf'),
+    domain='rarbgunblocked.org',
+    block_size=None,
+    path=STORE_PATH,
+    torrent_filter=None,
+):
+    """answer a query from previously scraped torrents only (no network), returns the same dicts as `main` outputs.
+    `sort` and `torrent_filter` are the ones of rarbgcli.filters"""
+    if isinstance(sort, str):
+        sort = [sort] if sort else []
+    # the store sorts by one key descending, anything more is ranked here and needs every matching row
+    in_sql = not torrent_filter and (not sort or len(sort) == 1 and not sort[0].startswith('+'))
+    with TorrentStore(path) as store:
+        rows = store.search(search, category, sort[0] if in_sql and sort else '', order, sort_order, limit if in_sql else None)
+    if not in_sql:
+        rows = rank(torrent_filter.apply(rows) if torrent_filter else rows, sort)
+        rows = rows[: int(limit)] if limit < float('inf') else rows
+    return [row.to_dict(domain, block_size) for row in rows]
+
+
+def rows_hash(rows):
+    """content hash of the parsed rows of a page (the raw html changes on every request)"""
+    return hashlib.sha1(repr([tuple(row) for row in rows]).encode('utf8')).hexdigest()
@@ -18,4 +18,14 @@ set +e
     | grep "magnet:?xt=urn:btih:7afb2e8a16ba3d828b383dc15d87a5c41dd9cfa4&dn=Brutal%20DooM%202013%20v18%20Classics-P2P&tr=http%3A%2F%2Ftracker.trackerfix.com%3A80%2Fannounce&tr=udp%3A%2F%2F9.rarbg.me%3A2710&tr=udp%3A%2F%2F9.rarbg.to%3A2710"  \
     && echo "test 2 success" \
     || (echo "test 2 fail" && exit 1)
+    ) && (
+    # startup stays fast: importing the CLI doesn't load the heavy dependencies
+    rarbg bench --startup \
+    && echo "test 3 success" \
+    || (echo "test 3 fail" && exit 1)
+    ) && (
+    # offline unit tests (parser fixtures, captcha solver daemon)
+    python -m pytest -q tests \
+    && echo "test 4 success" \
+    || (echo "test 4 fail" && exit 1)
 )
@@ -0,0 +1,89 @@
+"""rarbgcli.cache.PageCache: least recently used eviction by entries and by rows, and the ttl"""
+
+import pytest
+
+from rarbgcli import cache as cache_module
+from rarbgcli.cache import PageCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """a time.monotonic() that only moves when told to"""
+
+    class Clock:
+        now = 1000.0
+
+        def __call__(self):
+            return self.now
+
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, 'monotonic', clock)
+    return clock
+
+
+def test_get_put():
+    cache = PageCache()
+    assert cache.get('page1') is None
+    cache.put('page1', iter(['a', 'b']))
+    assert cache.get('page1') == ['a', 'b']
+    assert cache.stats() == {'entries': 1, 'rows': 2, 'hits': 1, 'misses': 1, 'evictions': 0}
+
+
+def test_evicts_least_recently_used_entries():
+    cache = PageCache(max_entries=2)
+    cache.put('page1', ['a'])
+    cache.put('page2', ['b'])
+    cache.get('page1')  # page2 is now the least recently used
+    cache.put('page3', ['c'])
+    assert (cache.get('page1'), cache.get('page2'), cache.get('page3')) == (['a'], None, ['c'])
+    assert cache.evictions == 1
+
+
+def test_evicts_by_row_count():
+    cache = PageCache(max_rows=5)
+    cache.put('page1', 'ab')
+    cache.put('page2', 'cd')
+    cache.put('page3', 'ef')
+    assert len(cache) == 2
+    assert cache.get('page1') is None
+    assert cache.stats()['rows'] == 4
+
+
+def test_keeps_a_page_bigger_than_max_rows():
+    cache = PageCache(max_rows=2)
+    cache.put('page1', 'a')
+    cache.put('page2', 'bcd')
+    assert (len(cache), cache.get('page2')) == (1, ['b', 'c', 'd'])
+
+
+def test_put_replaces_the_rows():
+    cache = PageCache()
+    cache.put('page1', 'abc')
+    cache.put('page1', 'd')
+    assert (len(cache), cache.stats()['rows'], cache.get('page1')) == (1, 1, ['d'])
+
+
+def test_ttl(clock):
+    cache = PageCache(ttl=60)
+    cache.put('page1', 'a')
+    clock.now += 60
+    assert cache.get('page1') == ['a']
+    clock.now += 1
+    assert cache.get('page1') is None
+
+
+def test_max_age_is_capped_by_the_ttl(clock):
+    cache = PageCache(ttl=60)
+    cache.put('page1', 'a')
+    clock.now += 30
+    assert cache.get('page1', max_age=10) is None
+    assert cache.get('page1', max_age=3600) == ['a']
+    clock.now += 31
+    assert cache.get('page1', max_age=3600) is None
+
+
+def test_clear():
+    cache = PageCache()
+    cache.put('page1', 'ab')
+    cache.clear()
+    assert (len(cache), cache.stats()['rows'], cache.get('page1')) == (0, 0, None)
@@ -0,0 +1,63 @@
+"""CookieManager.solve: when the cookies another process saved are picked up instead of solving the captcha"""
+
+import json
+
+import pytest
+
+from rarbgcli import cookies as cookies_module
+from rarbgcli.cookies import CookieManager
+
+URL = 'https://rarbgunblocked.org/threat_defence.php?defence=1'
+SOLVED = {'skt': 'solved here'}
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    solved = []
+
+    def deal_with_threat_defence(url):
+        solved.append(url)
+        return SOLVED
+
+    monkeypatch.setattr(cookies_module, 'deal_with_threat_defence', deal_with_threat_defence)
+    path = tmp_path / 'cookies.json'
+    path.write_text(json.dumps({'skt': 'old'}))
+    manager = CookieManager(str(path), log=lambda *a: None)
+    manager.solved = solved
+    return manager
+
+
+def save(manager, cookies):
+    """what another process solving the captcha leaves behind"""
+    with open(manager.path, 'w') as f:
+        json.dump(cookies, f)
+
+
+def test_failed_cookies_are_solved_again(manager):
+    sent = manager.load()
+    assert manager.solve(URL, sent) == SOLVED
+    assert manager.solved == [URL]
+    assert manager.load() == SOLVED
+
+
+def test_no_cookie_does_not_reuse_the_saved_cookies(manager):
+    assert manager.load(no_cookie=True) == {}
+    assert manager.solve(URL, {}) == SOLVED
+    assert manager.solved == [URL]
+
+
+def test_cookies_of_another_process_are_reused(manager):
+    sent = manager.load()
+    save(manager, {'skt': 'solved elsewhere'})
+    assert manager.solve(URL, sent) == {'skt': 'solved elsewhere'}
+    assert manager.solved == []
+    # once they fail too, this process solves it
+    assert manager.solve(URL, {'skt': 'solved elsewhere'}) == SOLVED
+    assert manager.solved == [URL]
+
+
+def test_no_cookie_reuses_cookies_solved_after_loading(manager):
+    manager.load(no_cookie=True)
+    save(manager, {'skt': 'solved elsewhere'})
+    assert manager.solve(URL, {}) == {'skt': 'solved elsewhere'}
+    assert manager.solved == []
@@ -0,0 +1,109 @@
+"""rarbgcli.filters: the numpy path of TorrentFilter and rank gives the same results as the pure python one"""
+
+import random
+
+import pytest
+
+from rarbgcli import filters
+from rarbgcli.filters import TorrentFilter, parse_size_arg, parse_sort_key, parse_time_arg, rank
+from rarbgcli.record import TorrentRecord
+
+N_ROWS = 3000  # above VECTORIZE_MIN_ROWS
+WORDS = ['doom', 'quake', 'CAM', 'hdts', '1080p', '720p', 'x264', 'flac']
+
+
+@pytest.fixture(scope='module')
+def records():
+    rng = random.Random(4)
+    return [
+        TorrentRecord(
+            title='.'.join(rng.sample(WORDS, 3)),
+            path=f'/torrent/{i}',
+            info_hash=b'',
+            date=rng.randrange(1500000000, 1500000000 + 50),
+            category_code='48',
+            size=rng.choice([0, 1 << 20, 1 << 30, 5 << 30, 1 << 40]),
+            seeders=rng.randrange(20),  # plenty of ties, so the stability shows
+            leechers=rng.randrange(5),
+            uploader=rng.choice(['Scene', 'rarbg', 'TvTeam']),
+        )
+        for i in range(N_ROWS)
+    ]
+
+
+@pytest.fixture
+def pure(monkeypatch):
+    """run without numpy whatever the row count"""
+
+    def switch():
+        monkeypatch.setattr(filters, '_np', lambda n_rows: None)
+
+    return switch
+
+
+def expected_rank(records, keys):
+    """rank as a chain of stable python sorts, least significant key first"""
+    records = list(records)
+    for field, descending in reversed([parse_sort_key(key) for key in keys]):
+        records.sort(key=lambda record: getattr(record, field), reverse=descending)
+    return records
+
+
+FILTERS = [
+    TorrentFilter(min_seeders=10),
+    TorrentFilter(min_size=1 << 30, max_size=5 << 30),
+    TorrentFilter(since=1500000010, until=1500000020, exclude=['cam', 'hdts']),
+    TorrentFilter(min_seeders=5, include=['doom'], uploaders=['scene', 'RARBG']),
+]
+SORTS = [['seeders'], ['+size'], ['seeders', '+size'], ['date', 'title'], ['+title', 'leechers', '+seeders']]
+
+
+@pytest.mark.parametrize('torrent_filter', FILTERS)
+def test_filter_numpy_matches_pure(records, pure, torrent_filter):
+    pytest.importorskip('numpy')
+    vectorized = torrent_filter.apply(records)
+    pure()
+    assert vectorized == torrent_filter.apply(records)
+
+
+@pytest.mark.parametrize('keys', SORTS)
+def test_rank_numpy_matches_pure(records, pure, keys):
+    pytest.importorskip('numpy')
+    vectorized = rank(records, keys)
+    pure()
+    assert vectorized == rank(records, keys) == expected_rank(records, keys)
+
+
+@pytest.mark.parametrize('keys', SORTS)
+def test_rank_pure(records, pure, keys):
+    pure()
+    assert rank(records, keys) == expected_rank(records, keys)
+
+
+def test_filter_pure(records, pure):
+    pure()
+    kept = TorrentFilter(min_seeders=10, max_size=1 << 30, exclude=['cam']).apply(records)
+    assert kept == [r for r in records if r.seeders >= 10 and r.size <= 1 << 30 and 'cam' not in r.title.lower()]
+
+
+def test_empty_filter_keeps_everything(records):
+    assert not TorrentFilter()
+    assert TorrentFilter().apply(records) == records
+
+
+@pytest.mark.parametrize('text, size', [('700MB', 700 * 10**6), ('1.5 gb', 1500 * 10**6), ('2000', 2000)])
+def test_parse_size_arg(text, size):
+    assert parse_size_arg(text) == size
+
+
+@pytest.mark.parametrize('text', ['', 'big', '-1GB', '1.5 XB'])
+def test_invalid_size_arg(text):
+    with pytest.raises(ValueError):
+        parse_size_arg(text)
+
+
+def test_parse_time_arg():
+    assert parse_time_arg('7d', now=1000000) == 1000000 - 7 * 24 * 3600
+    assert parse_time_arg('2w', now=2000000) == 2000000 - 2 * 7 * 24 * 3600
+    with pytest.raises(ValueError):
+        parse_time_arg('yesterday')
@@ -0,0 +1,158 @@
+"""
+the per host scheduling of rarbgcli.hosts: token buckets, cooldowns, the order mirrors are picked in,
+and rarbgcli.session.Session failing over between local stand-ins of the mirrors.
+"""
+
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from rarbgcli.hosts import HostScheduler
+from rarbgcli.session import Session
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    """answers every request with the server's `status` (and `retry_after`), and counts them"""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits.append(self.path)
+        body = f'{server.name} {self.path}'.encode()
+        self.send_response(server.status)
+        if server.retry_after is not None:
+            self.send_header('Retry-After', server.retry_after)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def mirror():
+    """start a stand-in mirror, returns it, its `host` is what goes in the mirror list"""
+    servers = []
+
+    def start(name, status=200, retry_after=None):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), MirrorHandler)
+        server.name, server.status, server.retry_after = name, status, retry_after
+        server.hits, server.lock = [], threading.Lock()
+        server.host = f'127.0.0.1:{server.server_address[1]}'
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def unused_host():
+    """a local address nothing listens on"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return f'127.0.0.1:{s.getsockname()[1]}'
+
+
+def test_token_bucket_spaces_the_requests():
+    scheduler = HostScheduler(rate=20)
+    start = time.monotonic()
+    for _ in range(5):
+        scheduler.acquire('a')
+    # the first token is there already, the 4 others take 1/20s each
+    assert 0.15 < time.monotonic() - start < 1
+
+
+def test_hosts_have_their_own_bucket():
+    scheduler = HostScheduler(rate=1)
+    start = time.monotonic()
+    for host in 'abcde':
+        scheduler.acquire(host)
+    assert time.monotonic() - start < 0.5
+
+
+def test_no_rate_never_waits():
+    scheduler = HostScheduler()
+    start = time.monotonic()
+    for _ in range(100):
+        scheduler.acquire('a')
+    assert time.monotonic() - start < 0.5
+
+
+def test_retry_after_cooldown_and_rate_recovery():
+    scheduler = HostScheduler(rate=10)
+    scheduler.report('a', 0.1, status=429, retry_after='0.3')
+    assert scheduler.stats()['a']['rate'] == 5
+    start = time.monotonic()
+    scheduler.acquire('a')
+    assert time.monotonic() - start > 0.25
+    scheduler.report('a', 0.1, status=200)
+    assert scheduler.stats()['a']['rate'] == 6
+    for _ in range(10):
+        scheduler.report('a', 0.1, status=200)
+    assert scheduler.stats()['a']['rate'] == 10
+
+
+def test_cooldown_doubles_with_each_failure_in_a_row():
+    scheduler = HostScheduler(max_cooldown=3)
+    cooldowns = []
+    for _ in range(4):
+        scheduler.report('a', 0.1, error=ConnectionError())
+        cooldowns.append(round(scheduler.hosts['a'].cooldown_until - time.monotonic(), 1))
+    assert cooldowns == [0.5, 1.0, 2.0, 3.0]
+    scheduler.report('a', 0.1, status=200)
+    assert scheduler.hosts['a'].failures_in_a_row == 0
+
+
+def test_failover_order():
+    scheduler = HostScheduler(['primary', 'second', 'third'])
+    url = 'https://primary/torrents.php?search=doom'
+    assert scheduler.pick(url) == 'primary'  # in list order among equals
+    assert scheduler.pick(url, exclude={'primary'}) == 'second'
+    assert scheduler.pick(url, exclude={'primary', 'second', 'third'}) == 'primary'
+    assert scheduler.has_alternative(url, {'primary', 'second'})
+    assert not scheduler.has_alternative(url, {'primary', 'second', 'third'})
+    # not a mirror url, e.g. the captcha images
+    assert scheduler.pick('https://dyncdn.me/captcha.png') == 'dyncdn.me'
+    assert not scheduler.has_alternative('https://dyncdn.me/captcha.png', set())
+
+    scheduler.report('primary', 0.1, status=503)
+    assert scheduler.pick(url) == 'second'  # on cooldown
+    scheduler.report('second', 2.0, status=200)
+    scheduler.report('third', 0.1, status=200)
+    assert scheduler.pick(url) == 'third'  # faster
+    assert HostScheduler.route(url, 'third') == 'https://third/torrents.php?search=doom'
+
+
+def test_session_fails_over_to_the_next_mirror(mirror):
+    down, up = mirror('down', status=503, retry_after='30'), mirror('up')
+    with Session(retries=0, mirrors=[down.host, up.host]) as session:
+        r = session.get(f'http://{down.host}/torrents.php?page=1')
+        assert (r.status_code, r.text) == (200, 'up /torrents.php?page=1')
+        # the throttling mirror is on cooldown, the next request goes straight to the other one
+        r = session.get(f'http://{down.host}/torrents.php?page=2')
+        assert r.text == 'up /torrents.php?page=2'
+        stats = session.scheduler.stats()
+    assert (len(down.hits), len(up.hits)) == (1, 2)
+    assert (stats[down.host]['errors'], stats[up.host]['errors']) == (1, 0)
+
+
+def test_session_fails_over_on_connection_errors(mirror):
+    gone, up = unused_host(), mirror('up')
+    with Session(retries=0, mirrors=[gone, up.host]) as session:
+        r = session.get(f'http://{gone}/torrents.php')
+        assert r.text == 'up /torrents.php'
+        assert session.scheduler.stats()[gone]['errors'] == 1
+
+
+def test_session_hands_back_the_last_error(mirror):
+    first, second = mirror('first', status=502), mirror('second', status=503)
+    with Session(retries=0, mirrors=[first.host, second.host]) as session:
+        assert session.get(f'http://{first.host}/torrents.php').status_code == 503
+    assert (len(first.hits), len(second.hits)) == (1, 1)
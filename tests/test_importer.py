@@ -0,0 +1,56 @@
+"""rarbg import-history: the category codes of the old history files, guessed from the category name or taken from a page"""
+
+import json
+import os
+import shutil
+
+from rarbgcli.importer import import_history
+from rarbgcli.store import TorrentStore
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'data', 'torrents.php.html')
+
+
+def history_dict(path, title, category):
+    """a torrent dict as the CLI saved them in history/*.json"""
+    return {
+        'title': title,
+        'href': f'https://rarbgunblocked.org{path}',
+        'date': 1600000000,
+        'category': category,
+        'size': '1.02 GB',
+        'seeders': 1,
+        'leechers': 0,
+        'uploader': 'someone',
+        'magnet': '',
+    }
+
+
+def import_dicts(tmp_path, dicts, with_page=False):
+    history = tmp_path / 'history'
+    history.mkdir()
+    (history / 'doom.json').write_text(json.dumps(dicts))
+    if with_page:
+        shutil.copy(FIXTURE, history / 'doom_torrents_1.html')
+        os.utime(history / 'doom_torrents_1.html', (1, 1))  # older, the history file would win the deduplication
+    store = TorrentStore(str(tmp_path / 'store.sqlite'))
+    import_history([str(history)], store, workers=1, log=lambda *a: None)
+    return store
+
+
+def test_unknown_category_stays_nonxxx(tmp_path):
+    with import_dicts(tmp_path, [history_dict('/torrent/game1', 'Some.Game-CODEX', 'UNKOWN')]) as store:
+        assert [record.title for record in store.search('game', 'nonxxx')] == ['Some.Game-CODEX']
+        assert store.search('game', 'xxx') == []
+
+
+def test_known_category_keeps_filtering(tmp_path):
+    with import_dicts(tmp_path, [history_dict('/torrent/music1', 'Doom.OST', 'music')]) as store:
+        assert len(store.search('doom', 'music')) == 1
+        assert store.search('doom', 'movies') == []
+
+
+def test_page_code_wins_over_the_guess(tmp_path):
+    dicts = [history_dict('/torrent/r7jpkx3', 'Brutal DooM 2013 v18 Classics-P2P', 'UNKOWN')]
+    with import_dicts(tmp_path, dicts, with_page=True) as store:
+        (record,) = store.search('brutal', 'games')
+        assert record.category_code == '27'
@@ -0,0 +1,78 @@
+"""
+the listing parser against a saved torrents.php page: every backend gives the same records, and their dicts are
+the ones the original BeautifulSoup scraping (findParent/select_one per field) produced.
+"""
+
+import datetime
+import os
+
+import pytest
+from bs4 import BeautifulSoup
+
+from rarbgcli import CODE2CATEGORY, extract_magnet, extract_torrent_file, format_size, parse_size
+from rarbgcli.parser import BACKENDS, parse_listing
+
+DOMAIN = 'rarbgunblocked.org'
+FIXTURE = os.path.join(os.path.dirname(__file__), 'data', 'torrents.php.html')
+
+
+@pytest.fixture(scope='module')
+def html():
+    with open(FIXTURE, 'rb') as f:
+        return f.read()
+
+
+def scrape_like_before(html, domain=DOMAIN, block_size=None):
+    """the torrent dicts as the CLI used to scrape them, a lookup from each title anchor's row per field"""
+    torrents = BeautifulSoup(html, 'html.parser').select('tr.lista2 a[href^="/torrent/"][title]')
+    return [
+        {
+            'title': torrent.get('title'),
+            'torrent': extract_torrent_file(torrent, domain=domain),
+            'href': f"https://{domain}{torrent.get('href')}",
+            'date': datetime.datetime.strptime(
+                str(torrent.find_parent('tr').select_one('td:nth-child(3)').contents[0]), '%Y-%m-%d %H:%M:%S'
+            ).timestamp(),
+            'category': CODE2CATEGORY.get(
+                torrent.find_parent('tr').select_one('td:nth-child(1) img').get('src').split('/')[-1].replace('cat_new', '').replace('.gif', ''),
+                'UNKOWN',
+            ),
+            'size': format_size(parse_size(torrent.find_parent('tr').select_one('td:nth-child(4)').contents[0]), block_size),
+            'seeders': int(torrent.find_parent('tr').select_one('td:nth-child(5) > font').contents[0]),
+            'leechers': int(torrent.find_parent('tr').select_one('td:nth-child(6)').contents[0]),
+            'uploader': str(torrent.find_parent('tr').select_one('td:nth-child(8)').contents[0]),
+            'magnet': extract_magnet(torrent),
+        }
+        for torrent in torrents
+    ]
+
+
+def test_fixture_has_rows_with_and_without_thumbnail(html):
+    records = parse_listing(html)
+    assert len(records) == 5
+    assert {bool(record.info_hash) for record in records} == {True, False}
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_backends_agree(html, backend):
+    assert parse_listing(html, backend=backend) == parse_listing(html, backend='stream')
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('block_size', [None, 'MB'])
+def test_dicts_match_previous_scraping(html, backend, block_size):
+    dicts = [record.to_dict(DOMAIN, block_size) for record in parse_listing(html, backend=backend)]
+    assert dicts == scrape_like_before(html.decode(), block_size=block_size)
+
+
+def test_row_without_thumbnail_has_no_magnet(html):
+    record = next(record for record in parse_listing(html) if record.path == '/torrent/wq2a8ne')
+    assert record.info_hash == b''
+    assert record.to_dict(DOMAIN)['magnet'] == ''
+
+
+def test_known_row(html):
+    record = parse_listing(html)[0]
+    assert record.hash == '7afb2e8a16ba3d828b383dc15d87a5c41dd9cfa4'
+    assert record.to_dict(DOMAIN)['magnet'].startswith('magnet:?xt=urn:btih:7afb2e8a16ba3d828b383dc15d87a5c41dd9cfa4&dn=Brutal%20DooM%202013')
+    assert (record.category_code, record.size, record.seeders, record.leechers, record.uploader) == ('27', parse_size('1.85 GB'), 12, 3, 'Scene')
@@ -0,0 +1,89 @@
+"""rarbgcli.planner.PagePlanner: how many pages a --limit needs, with filters and with a --sort the site's --order matches or not"""
+
+import pytest
+
+from rarbgcli.planner import PagePlanner, sorted_by_order
+from rarbgcli.record import TorrentRecord
+
+
+def torrents(n, seeders=None):
+    """n torrents, by decreasing seeders unless given"""
+    seeders = seeders if seeders is not None else range(1000, 1000 - n, -1)
+    return [TorrentRecord(f'torrent {i}', f'/torrent/{i}', b'', 0, '48', 0, s, 0, '') for i, s in enumerate(seeders)]
+
+
+def test_unbounded_without_limit():
+    planner = PagePlanner()
+    planner.add(torrents(25))
+    assert not planner.bounded
+    assert planner.last_page() is None
+    assert not planner.done()
+
+
+@pytest.mark.parametrize('limit, last_page', [(1, 1), (25, 1), (26, 2), (60, 3), (100, 4)])
+def test_limit_needs_ceil_pages(limit, last_page):
+    assert PagePlanner(limit).last_page() == last_page
+
+
+def test_done_once_the_limit_is_met():
+    planner = PagePlanner(30)
+    planner.add(torrents(25))
+    assert (planner.done(), planner.last_page()) == (False, 2)
+    planner.add(torrents(25))
+    assert (planner.done(), planner.last_page()) == (True, 2)
+
+
+def test_filtered_pages_estimate_from_the_share_kept():
+    planner = PagePlanner(20)
+    planner.add(torrents(5), rows=25)  # a fifth of the rows pass the filters
+    assert planner.last_page() == 1 + 3  # 15 missing at 5 per page
+    planner.add(torrents(10), rows=25)
+    assert planner.last_page() == 2 + 1
+
+
+def test_nothing_kept_yet_is_unbounded():
+    planner = PagePlanner(10)
+    planner.add([], rows=25)
+    assert planner.last_page() is None
+
+
+def test_sort_needs_every_page():
+    planner = PagePlanner(10, sort=['seeders'])
+    planner.add(torrents(25))
+    assert not planner.bounded
+    assert not planner.done()
+    assert planner.last_page() is None
+
+
+@pytest.mark.parametrize(
+    'sort, order, sort_order, ordered',
+    [
+        (['seeders'], 'seeders', None, True),
+        (['seeders'], 'seeders', 'desc', True),
+        (['seeders'], 'seeders', 'asc', False),
+        (['+seeders'], 'seeders', 'asc', True),
+        (['date'], 'data', None, True),
+        (['size'], 'seeders', None, False),
+        (['seeders'], '', None, False),
+        ([], 'seeders', None, False),
+    ],
+)
+def test_sorted_by_order(sort, order, sort_order, ordered):
+    assert sorted_by_order(sort, order, sort_order) == ordered
+
+
+def test_sort_matching_the_order_is_bounded():
+    planner = PagePlanner(10, sort=['seeders'], order='seeders')
+    assert planner.last_page() == 1
+    planner.add(torrents(25))
+    assert planner.done()
+
+
+def test_ties_on_the_first_key_need_the_next_page():
+    planner = PagePlanner(10, sort=['seeders', 'size'], order='seeders')
+    # the 10th torrent ties with the last of the page, the next page may have more of them that rank above by size
+    planner.add(torrents(25, seeders=[100] * 9 + [50] * 16))
+    assert not planner.done()
+    assert planner.last_page() == 2
+    planner.add(torrents(25, seeders=[50] * 5 + [10] * 20))
+    assert planner.done()
@@ -0,0 +1,60 @@
+"""rarbgcli.record.TorrentIndex: deduplication by info-hash or page path, and how a torrent seen again is merged. TorrentKeys agrees"""
+
+from rarbgcli.record import TorrentIndex, TorrentKeys, TorrentRecord
+
+HASH = bytes.fromhex('7afb2e8a16ba3d828b383dc15d87a5c41dd9cfa4')
+OTHER_HASH = bytes.fromhex('d787669ee4a103fe0b361fe31c10ea037c72f27c')
+
+
+def torrent(path, info_hash=b'', seeders=0):
+    return TorrentRecord(f'title of {path}', path, info_hash, 0, '48', 0, seeders, 0, '')
+
+
+def test_dedup_by_hash_and_path():
+    index = TorrentIndex([torrent('/torrent/a', HASH), torrent('/torrent/b'), torrent('/torrent/b'), torrent('/torrent/c', HASH)])
+    # /torrent/c has /torrent/a's hash (a reupload listed under another path), it's the same torrent
+    assert [record.path for record in index] == ['/torrent/c', '/torrent/b']
+    assert len(index) == 2
+
+
+def test_last_write_wins_in_place():
+    index = TorrentIndex([torrent('/torrent/a', HASH, seeders=1), torrent('/torrent/b', seeders=1)])
+    index.add([torrent('/torrent/a', HASH, seeders=5)])
+    assert [(record.path, record.seeders) for record in index] == [('/torrent/a', 5), ('/torrent/b', 1)]
+
+
+def test_overwrite_false_keeps_the_first():
+    index = TorrentIndex([torrent('/torrent/a', HASH, seeders=1)])
+    index.add([torrent('/torrent/a', HASH, seeders=5), torrent('/torrent/b')], overwrite=False)
+    assert [(record.path, record.seeders) for record in index] == [('/torrent/a', 1), ('/torrent/b', 0)]
+
+
+def test_known_hash_is_never_lost():
+    index = TorrentIndex([torrent('/torrent/a', HASH, seeders=1)])
+    index.add([torrent('/torrent/a', seeders=5)])  # listed again without its thumbnail
+    assert [(record.info_hash, record.seeders) for record in index] == [(HASH, 5)]
+
+
+def test_hash_learned_later_merges_with_the_path():
+    index = TorrentIndex([torrent('/torrent/a')])
+    index.add([torrent('/torrent/a', HASH)])
+    assert list(index) == [torrent('/torrent/a', HASH)]
+    # both the path and the hash find it now
+    assert torrent('/torrent/a') in index
+    assert torrent('/torrent/z', HASH) in index
+
+
+def test_contains():
+    index = TorrentIndex([torrent('/torrent/a', HASH), torrent('/torrent/b')])
+    assert torrent('/torrent/b') in index
+    assert torrent('/torrent/b', OTHER_HASH) in index  # by its path
+    assert torrent('/torrent/c') not in index
+    assert torrent('/torrent/c', OTHER_HASH) not in index
+
+
+def test_keys_agree_with_the_index():
+    added = [torrent('/torrent/a', HASH), torrent('/torrent/b'), torrent('/torrent/b'), torrent('/torrent/c', HASH), torrent('/torrent/d')]
+    index, keys = TorrentIndex(added), TorrentKeys(added)
+    assert len(keys) == len(index) == 3
+    for record in [*added, torrent('/torrent/b', OTHER_HASH), torrent('/torrent/z', HASH), torrent('/torrent/z'), torrent('/torrent/z', OTHER_HASH)]:
+        assert (record in keys) == (record in index)
@@ -0,0 +1,40 @@
+"""the /search query string validation of `rarbg serve`"""
+
+import pytest
+
+from rarbgcli.server import BadRequest, parse_search_params
+
+
+def test_defaults():
+    args = parse_search_params('q=brutal+doom')
+    assert args == {'search': 'brutal doom', 'category': 'nonxxx', 'order': '', 'sort_order': None, 'sort': (), 'limit': float('inf')}
+
+
+@pytest.mark.parametrize(
+    'query, sort',
+    [
+        ('sort=seeders', ('seeders',)),
+        ('sort=%2Bsize', ('+size',)),
+        ('sort=seeders,%2Bsize', ('seeders', '+size')),
+        ('sort=seeders&sort=%2Bsize', ('seeders', '+size')),
+    ],
+)
+def test_sort_keys_like_the_cli(query, sort):
+    assert parse_search_params(f'q=doom&{query}')['sort'] == sort
+
+
+@pytest.mark.parametrize('query', ['', 'q=', 'q=doom&sort=bogus', 'q=doom&sort=%2B', 'q=doom&category=bogus', 'q=doom&sort_order=up'])
+def test_invalid_params(query):
+    with pytest.raises(BadRequest):
+        parse_search_params(query)
+
+
+@pytest.mark.parametrize('limit', ['nan', 'NaN', '-inf', '0', '0.5', 'ten'])
+def test_invalid_limits(limit):
+    with pytest.raises(BadRequest):
+        parse_search_params(f'q=doom&limit={limit}')
+
+
+@pytest.mark.parametrize('limit, value', [('10', 10), ('inf', float('inf')), ('1e3', 1000)])
+def test_limits(limit, value):
+    assert parse_search_params(f'q=doom&limit={limit}')['limit'] == value
@@ -0,0 +1,198 @@
+"""
+the captcha solver daemon against a local stand-in of the threat_defence page, with the OCR stubbed.
+
+The protocol tests run anywhere (the browser is replaced by a stub solver), the end to end one needs
+chromedriver on the PATH and is skipped otherwise.
+"""
+
+import contextlib
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import rarbgcli
+from rarbgcli import solver as solver_module
+from rarbgcli.solver import CaptchaSolver, _request, serve, solve_remote
+
+SOLUTION = 'ABC123'
+SOLVED_COOKIES = {'skt': 'solved'}
+# 1x1 png, the captcha image only has to load
+PNG = bytes.fromhex(
+    '89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082'
+)
+
+
+class ThreatDefenceHandler(BaseHTTPRequestHandler):
+    """stand-in of rarbg's threat_defence.php: a "Click here" link, then the captcha form, then a redirect with the cookies"""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path.endswith('.png'):
+            return self._send(200, PNG, 'image/png')
+        if url.path == '/torrents.php':
+            return self._send(200, b'<html><body>torrents</body></html>')
+        if params.get('solve_string') == SOLUTION:
+            self.send_response(302)
+            self.send_header('Set-Cookie', 'skt=solved; Path=/')
+            self.send_header('Location', '/torrents.php')
+            self.end_headers()
+            return
+        if 'defence' not in params:
+            return self._send(200, b'<html><body><a href="/threat_defence.php?defence=2">Click here</a></body></html>')
+        form = (
+            '<html><body><img src="/logo.png"><img src="/captcha.png">'
+            '<form action="/threat_defence.php"><input type="hidden" name="defence" value="2">'
+            '<input type="text" id="solve_string" name="solve_string"></form></body></html>'
+        )
+        self._send(200, form.encode())
+
+    def _send(self, status, body, content_type='text/html'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def threat_defence_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ThreatDefenceHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/threat_defence.php'
+    server.shutdown()
+    server.server_close()
+
+
+class StubSolver:
+    """stands in for CaptchaSolver without a browser"""
+
+    def __init__(self, result=SOLVED_COOKIES):
+        self.result = result
+        self.urls = []
+
+    def solve(self, url, attempts=3):
+        self.urls.append(url)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+    def close(self):
+        pass
+
+    def close_if_idle(self, idle_timeout):
+        pass
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    """start serve() with `solver` in a thread, returns the path of its solver.json"""
+    threads = []
+    path = str(tmp_path / 'solver.json')
+
+    def start(solver, client_timeout=10):
+        thread = threading.Thread(
+            target=serve, kwargs={'path': path, 'log': lambda *a: None, 'client_timeout': client_timeout, 'solver': solver}, daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+        for _ in range(100):
+            if os.path.exists(path) and os.path.getsize(path):
+                return path
+            time.sleep(0.05)
+        raise AssertionError('the daemon did not start')
+
+    yield start
+    for thread in threads:
+        if thread.is_alive():
+            _request(('stop',), 10, path)
+        thread.join(10)
+
+
+def test_solve_remote_round_trip(daemon):
+    stub = StubSolver()
+    path = daemon(stub)
+    assert solve_remote('http://example/threat_defence.php', path=path) == SOLVED_COOKIES
+    assert stub.urls == ['http://example/threat_defence.php']
+
+
+def test_stop_removes_solver_json(daemon):
+    path = daemon(StubSolver())
+    _request(('stop',), 10, path)
+    for _ in range(100):
+        if not os.path.exists(path):
+            break
+        time.sleep(0.05)
+    assert not os.path.exists(path)
+
+
+def test_wrong_key_does_not_stop_the_daemon(daemon):
+    path = daemon(StubSolver())
+    with open(path) as f:
+        port = json.load(f)['port']
+    with pytest.raises(AuthenticationError):
+        Client(('127.0.0.1', port), authkey=b'not the key')
+    assert solve_remote('http://example/threat_defence.php', path=path) == SOLVED_COOKIES
+
+
+def test_silent_client_does_not_block_the_daemon(daemon):
+    path = daemon(StubSolver(), client_timeout=0.5)
+    with open(path) as f:
+        port = json.load(f)['port']
+    with socket.create_connection(('127.0.0.1', port)):  # connects and never answers the challenge
+        assert solve_remote('http://example/threat_defence.php', timeout=10, path=path) == SOLVED_COOKIES
+
+
+def test_remote_errors_surface(daemon):
+    path = daemon(StubSolver(RuntimeError('captcha not solved after 3 attempts')))
+    with pytest.raises(RuntimeError, match='not solved'):
+        solve_remote('http://example/threat_defence.php', path=path)
+
+
+def test_no_daemon_is_file_not_found(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        solve_remote('http://example/threat_defence.php', path=str(tmp_path / 'solver.json'))
+
+
+@pytest.mark.parametrize('error, falls_back', [(FileNotFoundError(), True), (ConnectionRefusedError(), True), (TimeoutError(), False)])
+def test_solve_captcha_falls_back_only_without_daemon(monkeypatch, error, falls_back):
+    def solve_remote(url):
+        raise error
+
+    local = StubSolver()
+    monkeypatch.setattr(solver_module, 'solve_remote', solve_remote)
+    monkeypatch.setattr(solver_module, 'CaptchaSolver', lambda: contextlib.nullcontext(local))
+    if falls_back:
+        assert rarbgcli.solve_captcha('http://example/threat_defence.php') == SOLVED_COOKIES
+    else:
+        with pytest.raises(TimeoutError):
+            rarbgcli.solve_captcha('http://example/threat_defence.php')
+        assert not local.urls
+
+
+@pytest.mark.skipif(shutil.which('chromedriver') is None, reason='needs chromedriver (and chrome) on the PATH')
+def test_solver_daemon_end_to_end(daemon, threat_defence_url):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+    options = Options()
+    options.add_argument('--no-sandbox')
+    options.add_argument('--headless')
+    solver = CaptchaSolver(timeout=10, log=lambda *a: None)
+    solver.driver = webdriver.Chrome(chrome_options=options)  # instead of the downloaded driver _start() uses
+    solver._tesseract_checked = True
+    solver.ocr = lambda png: SOLUTION
+    path = daemon(solver)
+    assert solve_remote(threat_defence_url, path=path) == SOLVED_COOKIES